@@ -1,18 +1,93 @@
 # standard library modules
+import heapq
 import sys
-from typing import List, cast
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from typing import Callable, Iterator, List, TypeVar, cast
 
 # 3rd party modules
 from pydantic import BaseModel
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import InstrumentedAttribute, sessionmaker, close_all_sessions
+from sqlalchemy import ColumnElement, Engine, create_engine, delete, event, func, select
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import InstrumentedAttribute, Session, sessionmaker, close_all_sessions
 
 # local modules
 from core.db.models import User, Question, Answer, Base
+from core.db.resilience import CircuitBreaker, TransientDatabaseError, apply_timeouts, guarded
+from core.db.sharding import HashRing
+from core.db.snapshot import SnapshotCache
+
+T = TypeVar("T")
+
+
+class UnitOfWork:
+    """
+    One session and transaction per database, shared by every `QueriesApp`
+    call it is passed to and committed once at the end (see
+    `core.main.endpoints.get_unit_of_work`). Sessions start lazily, so a
+    request touching a single database checks out a single connection.
+    """
+
+    def __init__(self):
+        self.sessions: dict[int, Session] = {}
+        # run by the owner once everything is committed
+        self.after_commit: list[Callable] = []
+        # set by a failed `QueriesApp` call: nothing of the unit is committed
+        self.failed = False
+
+    def session_for(self, maker: sessionmaker) -> Session:
+        session = self.sessions.get(id(maker))
+        if session is None:
+            session = maker()
+            session.begin()
+            self.sessions[id(maker)] = session
+        return session
+
+    def commit(self) -> None:
+        if self.failed:
+            self.rollback()
+            return
+
+        # the first DB written (e.g. the global one for users) commits last,
+        # so a failed commit elsewhere leaves it untouched and a retry succeeds
+        for session in reversed(self.sessions.values()):
+            transaction = session.get_transaction()
+            # a failed flush has already rolled its transaction back
+            if transaction is not None and transaction.is_active:
+                session.commit()
+            else:
+                session.rollback()
+
+    def rollback(self) -> None:
+        for session in self.sessions.values():
+            session.rollback()
+
+    def close(self) -> None:
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
 
 
 class QueriesApp:
-    def __init__(self, engine=None, db_uri=None):
+    """
+    `engine`/`db_uri` is the global DB: users are read from it.
+    With `shard_uris`, questions and their answers are spread over those DBs
+    by a consistent hash of the question id, and users are written to every
+    DB so answers keep their foreign key. `db_uri` may be one of the shards.
+    `previous_shards` is the shard count before a rebalance; while it is set,
+    questions not yet moved are still found on their old shard.
+    `snapshot`, when set, serves `get_question`/`get_answers` during warm-up.
+    """
+
+    def __init__(
+            self,
+            engine=None,
+            db_uri=None,
+            breaker: CircuitBreaker | None = None,
+            shard_uris: list[str] | None = None,
+            previous_shards: int | None = None
+    ):
         if engine:
             self.engine = engine
         else:
@@ -23,30 +98,153 @@ class QueriesApp:
 
         self.session = sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
 
+        # question shards; the global DB alone when not sharded
+        self.shards: list[sessionmaker] = [self.session]
+        if shard_uris:
+            self.shards = [
+                self.session if uri == db_uri else
+                sessionmaker(bind=create_engine(uri), autoflush=False, expire_on_commit=False)
+                for uri in shard_uris
+            ]
+        self.ring = HashRing(len(self.shards))
+        self.previous_ring = HashRing(previous_shards) if previous_shards else None
+
+        self.sessionmakers: list[sessionmaker] = [self.session] + [
+            shard for shard in self.shards if shard is not self.session]
+        self.engines: list[Engine] = [maker.kw["bind"] for maker in self.sessionmakers]
+        self._fan_out_pool = ThreadPoolExecutor(max_workers=len(self.shards)) if len(self.shards) > 1 else None
+
+        # request deadline -> statement/lock timeouts of every transaction
+        for maker in self.sessionmakers:
+            event.listen(maker, "after_begin", apply_timeouts)
+
+        self.breaker = breaker
+        if breaker is not None:
+            for engine in self.engines:
+                event.listen(engine, "before_cursor_execute", breaker.before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", breaker.after_cursor_execute)
+                event.listen(engine, "handle_error", breaker.handle_error)
+
+        self.snapshot: SnapshotCache | None = None
+
     @staticmethod
     def convert_model_to_orm(model_obj: BaseModel, model_orm: type[Base]):
         return model_orm(**model_obj.model_dump())
 
     def close(self):
         close_all_sessions()
-        self.engine.dispose()
+        if self._fan_out_pool:
+            self._fan_out_pool.shutdown()
+        for engine in self.engines:
+            engine.dispose()
+
+    @guarded
+    def commit(self, uow: UnitOfWork) -> bool:
+        """Commit `uow`, or roll it back if a call failed; an unreachable DB raises `DatabaseUnavailable`"""
+        try:
+            uow.commit()
+            return not uow.failed
+
+        except (OperationalError, InterfaceError) as e:
+            uow.rollback()
+            raise TransientDatabaseError(f"Commit failed: {e}") from e
+        except Exception as e:
+            print(f"[ERROR]\t{e}")
+            uow.rollback()
+            return False
+
+    @staticmethod
+    def _error(e: Exception, uow: UnitOfWork | None) -> None:
+        print(f"[ERROR]\t{e}")
+        if uow is not None:
+            uow.failed = True
+
+    @contextmanager
+    def _atomic(self, uow: UnitOfWork | None) -> Iterator[UnitOfWork]:
+        """`uow`, or one of its own: writes to several DBs stand or fall together"""
+        if uow is not None:
+            yield uow
+            return
+
+        own = UnitOfWork()
+        try:
+            yield own
+            own.commit()
+        except Exception:
+            own.rollback()
+            raise
+        finally:
+            own.close()
+
+    @contextmanager
+    def _begin(self, maker: sessionmaker, uow: UnitOfWork | None) -> Iterator[Session]:
+        """The unit of work's session, or a transaction of its own"""
+        if uow is not None:
+            yield uow.session_for(maker)
+            return
+
+        with maker.begin() as session:
+            yield session
+
+    def _invalidate_snapshot(self, question_id: int | None) -> None:
+        snapshot = self.snapshot
+        if snapshot is not None and question_id is not None:
+            snapshot.invalidate(question_id)
+
+    # Shard routing ---------------------------------
+    def _question_shard(self, question_id: int | InstrumentedAttribute[int]) -> sessionmaker:
+        owner = self.ring.shard_for(question_id)
+        if self.previous_ring is None:
+            return self.shards[owner]
+
+        previous = self.previous_ring.shard_for(question_id)
+        if previous == owner:
+            return self.shards[owner]
+
+        # mid-rebalance: the question may not have moved yet
+        for shard in (owner, previous):
+            with self.shards[shard].begin() as session:
+                if session.get(Question, question_id) is not None:
+                    return self.shards[shard]
+        return self.shards[owner]
+
+    def _fan_out(self, query: Callable[[Session], T], uow: UnitOfWork | None = None) -> list[T]:
+        """Run `query` on every shard, in parallel when there are several"""
+
+        def run(shard: sessionmaker) -> T:
+            with self._begin(shard, uow) as session:
+                return query(session)
+
+        # sessions of a unit of work are not shared between threads
+        if self._fan_out_pool is None or uow is not None:
+            return [run(shard) for shard in self.shards]
+
+        # each thread gets the caller's context, deadline included
+        futures = [self._fan_out_pool.submit(copy_context().run, run, shard) for shard in self.shards]
+        return [future.result() for future in futures]
 
 
     # QUERIES
     # Users -----------------------------------------
-    def get_user(self, user_id: str | InstrumentedAttribute[str]) -> User | None:
+    @guarded
+    def get_user(
+            self,
+            user_id: str | InstrumentedAttribute[str],
+            uow: UnitOfWork | None = None
+    ) -> User | None:
         try:
-            with self.session.begin() as session:
+            with self._begin(self.session, uow) as session:
                 user = session.get(User, user_id)
                 return user
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return None
 
 
-    def get_all_users(self) -> List[User] | None:
+    @guarded
+    def get_all_users(self, uow: UnitOfWork | None = None) -> List[User] | None:
         try:
-            with self.session.begin() as session:
+            with self._begin(self.session, uow) as session:
                 users: List[User] = cast(
                     List[User],
                     session.execute(select(User)).scalars().all()
@@ -54,92 +252,159 @@ class QueriesApp:
                 return users
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return None
 
 
-    def create_user(self, user: User) -> bool:
+    @guarded
+    def create_user(self, user: User, uow: UnitOfWork | None = None) -> bool:
         try:
-            with self.session.begin() as session:
-                session.add(user)
-                session.commit()
-                return True
+            with self._atomic(uow) as work:
+                with self._begin(self.session, work) as session:
+                    session.add(user)
+                    session.flush()
+
+                # replicas, so answers on every shard can reference the user
+                for replica in self.sessionmakers[1:]:
+                    with self._begin(replica, work) as session:
+                        session.merge(User(id=user.id))
+                        session.flush()
+            return True
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return False
 
 
-    def delete_user(self, user_id: str | InstrumentedAttribute[str]) -> bool:
+    @guarded
+    def delete_user(
+            self,
+            user_id: str | InstrumentedAttribute[str],
+            uow: UnitOfWork | None = None
+    ) -> bool:
         try:
-            with self.session.begin() as session:
-                user = session.get(User, user_id)
-                session.delete(user)
-                session.commit()
-                return True
-
+            snapshot = self.snapshot
+            if snapshot is not None:
+                snapshot.invalidate_user(user_id)
+
+            with self._atomic(uow) as work:
+                with self._begin(self.session, work) as session:
+                    user = session.get(User, user_id)
+                    # already deleted, e.g. by a retried background job
+                    if user is not None:
+                        session.delete(user)
+                    session.flush()
+
+                for replica in self.sessionmakers[1:]:
+                    with self._begin(replica, work) as session:
+                        user = session.get(User, user_id)
+                        if user is not None:
+                            session.delete(user)
+                        session.flush()
+            return True
+
+        # background jobs retry these, see `core.main.jobs`
+        except (OperationalError, InterfaceError) as e:
+            raise TransientDatabaseError(str(e)) from e
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return False
 
 
     # Questions -------------------------------------
-    def get_question(self, question_id: int | InstrumentedAttribute[int]) -> Question | None:
+    @guarded
+    def get_question(
+            self,
+            question_id: int | InstrumentedAttribute[int],
+            uow: UnitOfWork | None = None
+    ) -> Question | None:
         try:
-            with self.session.begin() as session:
+            snapshot = self.snapshot
+            if snapshot is not None and (q := snapshot.get_question(question_id)) is not None:
+                return q
+
+            with self._begin(self._question_shard(question_id), uow) as session:
                 q = session.get(Question, question_id)
                 return q
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return None
 
 
-    def get_all_questions(self) -> List[Question] | None:
+    @guarded
+    def get_all_questions(self, uow: UnitOfWork | None = None) -> List[Question] | None:
+        def shard_questions(session: Session) -> List[Question]:
+            return cast(
+                List[Question],
+                session.execute(
+                    select(Question).order_by(Question.id)
+                ).scalars().all()
+            )
+
         try:
-            with self.session.begin() as session:
-                q: List[Question] = cast(
-                    List[Question],
-                    session.execute(
-                        select(Question)
-                    ).scalars().all()
-                )
-                return q
+            # every shard is sorted by id, merge keeps it that way
+            q: List[Question] = list(heapq.merge(
+                *self._fan_out(shard_questions, uow), key=lambda question: question.id))
+            return q
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return None
 
 
-    def create_question(self, question: Question) -> bool:
+    @guarded
+    def create_question(self, question: Question, uow: UnitOfWork | None = None) -> bool:
         try:
-            with self.session.begin() as session:
+            if question.id is None and len(self.shards) > 1:
+                raise ValueError("Sharded questions need an explicit id")
+
+            with self._begin(self._question_shard(question.id), uow) as session:
                 session.add(question)
-                session.commit()
+                session.flush()
                 return True
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return False
 
 
-    def delete_question(self, question_id: int | InstrumentedAttribute[int]) -> bool:
+    @guarded
+    def delete_question(
+            self,
+            question_id: int | InstrumentedAttribute[int],
+            uow: UnitOfWork | None = None
+    ) -> bool:
         try:
-            with self.session.begin() as session:
+            self._invalidate_snapshot(question_id)
+            with self._begin(self._question_shard(question_id), uow) as session:
                 question = session.get(Question, question_id)
-                session.delete(question)
-                session.commit()
+                # already deleted, e.g. by a retried background job
+                if question is not None:
+                    session.delete(question)
+                    session.flush()
                 return True
 
+        except (OperationalError, InterfaceError) as e:
+            raise TransientDatabaseError(str(e)) from e
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return False
 
 
     # Answers ---------------------------------------
-    def get_answers(self, question_id: int | InstrumentedAttribute[int]) -> List[Answer] | None:
+    @guarded
+    def get_answers(
+            self,
+            question_id: int | InstrumentedAttribute[int],
+            uow: UnitOfWork | None = None
+    ) -> List[Answer] | None:
         try:
-            with self.session.begin() as session:
+            snapshot = self.snapshot
+            if snapshot is not None and (answers := snapshot.get_answers(question_id)) is not None:
+                return answers
+
+            with self._begin(self._question_shard(question_id), uow) as session:
                 answers: List[Answer] = cast(
                     List[Answer],
                     session.execute(
@@ -148,48 +413,138 @@ class QueriesApp:
                 )
                 return answers
 
+        except Exception as e:
+            self._error(e, uow)
+            return None
+
+
+    @guarded
+    def get_answer(
+            self,
+            answer_id: int | InstrumentedAttribute[int],
+            uow: UnitOfWork | None = None
+    ) -> Answer | None:
+        def shard_answer(session: Session) -> Answer | None:
+            return session.get(Answer, answer_id)
+
+        try:
+            # answers are placed by question, so look everywhere
+            found = [answer for answer in self._fan_out(shard_answer, uow) if answer is not None]
+            return found[0] if found else None
+
+        except Exception as e:
+            self._error(e, uow)
+            return None
+
+
+    def _answer_shards(self, question_id: int | None, user_id: str | None) -> tuple[list[sessionmaker], ColumnElement[bool]]:
+        """Shards holding the answers of a question or of a user, and the filter"""
+        if question_id is not None:
+            return [self._question_shard(question_id)], Answer.question_id == question_id
+        return self.shards, Answer.user_id == user_id
+
+
+    @guarded
+    def count_answers(self, question_id: int | None = None, user_id: str | None = None) -> int | None:
+        try:
+            shards, criterion = self._answer_shards(question_id, user_id)
+            n = 0
+            for shard in shards:
+                with self._begin(shard, None) as session:
+                    n += session.execute(select(func.count(Answer.id)).where(criterion)).scalar_one()
+            return n
+
+        # background jobs retry these, see `core.main.jobs`
+        except (OperationalError, InterfaceError) as e:
+            raise TransientDatabaseError(str(e)) from e
         except Exception as e:
             print(f"[ERROR]\t{e}")
             return None
 
 
-    def get_answer(self, answer_id: int | InstrumentedAttribute[int]) -> Answer | None:
+    @guarded
+    def delete_answers_batch(
+            self,
+            batch_size: int,
+            question_id: int | None = None,
+            user_id: str | None = None
+    ) -> int | None:
+        """
+        Delete up to `batch_size` answers of a question or of a user per shard,
+        each shard in a short transaction of its own, so locks are held briefly.
+        Returns the number deleted, 0 once there are none left.
+        """
         try:
-            with self.session.begin() as session:
-                answer = session.get(Answer, answer_id)
-                return answer
+            snapshot = self.snapshot
+            if question_id is not None:
+                self._invalidate_snapshot(question_id)
+            elif snapshot is not None:
+                snapshot.invalidate_user(user_id)
+
+            shards, criterion = self._answer_shards(question_id, user_id)
+            deleted = 0
+            for shard in shards:
+                with self._begin(shard, None) as session:
+                    answer_ids = session.execute(
+                        select(Answer.id).where(criterion).order_by(Answer.id).limit(batch_size)
+                    ).scalars().all()
+                    if answer_ids:
+                        session.execute(delete(Answer).where(Answer.id.in_(answer_ids)))
+                    deleted += len(answer_ids)
+            return deleted
 
+        except (OperationalError, InterfaceError) as e:
+            raise TransientDatabaseError(str(e)) from e
         except Exception as e:
             print(f"[ERROR]\t{e}")
             return None
 
 
-    def create_answer(self, answer: Answer) -> bool:
+    @guarded
+    def create_answer(self, answer: Answer, uow: UnitOfWork | None = None) -> bool:
         try:
             question_id: int | InstrumentedAttribute[int] = answer.question_id
-            is_question_in_db: bool = self.get_question(question_id)
+            is_question_in_db: bool = self.get_question(question_id, uow=uow)
             if is_question_in_db:
+                # each shard only enforces its own primary key, answers live on their question's shard
+                if len(self.shards) > 1:
+                    if answer.id is None:
+                        raise ValueError("Sharded answers need an explicit id")
+                    if self.get_answer(answer.id) is not None:
+                        raise ValueError(f"Answer {answer.id} already exists")
+
+                self._invalidate_snapshot(question_id)
 
-                with self.session.begin() as session:
+                with self._begin(self._question_shard(question_id), uow) as session:
                     session.add(answer)
-                    session.commit()
+                    session.flush()
                     return True
             else:
                 return False
 
         except Exception as e:
-            print(f"[ERROR]\tGeneral exception: {e}")
+            self._error(e, uow)
             return False
 
 
-    def delete_answer(self, answer_id: int | InstrumentedAttribute[int]) -> bool:
+    @guarded
+    def delete_answer(
+            self,
+            answer_id: int | InstrumentedAttribute[int],
+            uow: UnitOfWork | None = None
+    ) -> bool:
         try:
-            with self.session.begin() as session:
+            shard = self.shards[0]
+            if len(self.shards) > 1:
+                shard = self._question_shard(self.get_answer(answer_id, uow=uow).question_id)
+
+            with self._begin(shard, uow) as session:
                 answer = session.get(Answer, answer_id)
+                self._invalidate_snapshot(answer.question_id)
                 session.delete(answer)
-                session.commit()
+                session.flush()
                 return True
 
         except Exception as e:
-            print(f"[ERROR]\t{e}")
+            self._error(e, uow)
             return False
@@ -0,0 +1,243 @@
+"""
+Request deadlines and a circuit breaker for `QueriesApp`
+
+A deadline is set per request (see `core.main.deadlines`) and travels with
+the request's context. Each transaction turns what is left of it into
+Postgres `statement_timeout` and `lock_timeout`.
+
+The breaker watches statement outcomes and latency. Once too many recent
+statements fail or are slow it opens, and `QueriesApp` calls fail fast with
+`CircuitOpen` until a probe succeeds.
+"""
+
+# standard library modules
+import functools
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar, Token
+
+# 3rd party modules
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+# local modules
+from core.settings import env
+
+
+class DatabaseUnavailable(Exception):
+    pass
+
+
+class DeadlineExceeded(DatabaseUnavailable):
+    pass
+
+
+class TransientDatabaseError(DatabaseUnavailable):
+    """Connection lost, timeout, lock wait: worth retrying"""
+
+
+class CircuitOpen(DatabaseUnavailable):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Database circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# Deadlines --------------------------------------
+# absolute `time.monotonic()` value, None for no deadline
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+
+def set_deadline(seconds: float) -> Token:
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def reset_deadline(token: Token) -> None:
+    _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline() -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+# execution option marking statements the breaker does not judge the DB by
+BREAKER_IGNORE = "breaker_ignore"
+
+# Postgres `query_canceled` (statement_timeout) and `lock_not_available` (lock_timeout)
+_TIMEOUT_SQLSTATES = ("57014", "55P03")
+# a cancel this close to the deadline came from the timeouts set by `apply_timeouts`
+_DEADLINE_SLACK = 0.1
+
+
+def apply_timeouts(session, transaction, connection) -> None:
+    """`after_begin` listener: bound the transaction by the request deadline"""
+    left = remaining()
+    if left is None:
+        return
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+
+    if connection.dialect.name == "postgresql":
+        ms = max(int(left * 1000), 1)
+        # SET LOCAL: reverts on commit/rollback, pooled connections stay clean
+        # always fast: counted by the breaker they would dilute real failures,
+        # and a half-open probe would pass on them alone
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {ms}",
+                                   execution_options={BREAKER_IGNORE: True})
+        connection.exec_driver_sql(f"SET LOCAL lock_timeout = {ms}",
+                                   execution_options={BREAKER_IGNORE: True})
+
+
+# set while a guarded call runs, so nested calls don't take a second breaker slot
+_guarded_call: ContextVar[bool] = ContextVar("guarded_call", default=False)
+
+
+def guarded(method):
+    """Fail fast on an expired deadline or open breaker; report timeouts as such"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _guarded_call.get():
+            return method(self, *args, **kwargs)
+
+        check_deadline()
+        if self.breaker is not None:
+            self.breaker.check()
+
+        token = _guarded_call.set(True)
+        try:
+            result = method(self, *args, **kwargs)
+        finally:
+            _guarded_call.reset(token)
+
+        # `QueriesApp` swallows DB errors, tell a timeout apart from a miss
+        if not result:
+            check_deadline()
+        return result
+
+    return wrapper
+
+
+# Circuit breaker --------------------------------
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+            self,
+            window: int = 50,
+            min_calls: int = 20,
+            failure_rate: float = 0.5,
+            slow_ms: float = 2000.0,
+            open_seconds: float = 10.0
+    ):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow = slow_ms / 1000
+        self.open_seconds = open_seconds
+
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self._outcomes: deque[bool] = deque(maxlen=window)  # True for failed or slow
+        self._probing = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker | None":
+        if not env("CIRCUIT_BREAKER", True):
+            return None
+
+        return cls(
+            window=env("BREAKER_WINDOW", 50),
+            min_calls=env("BREAKER_MIN_CALLS", 20),
+            failure_rate=env("BREAKER_FAILURE_RATE", 0.5),
+            slow_ms=env("BREAKER_SLOW_MS", 2000.0),
+            open_seconds=env("BREAKER_OPEN_SECONDS", 10.0),
+        )
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def check(self) -> None:
+        """Raise `CircuitOpen` unless a call may go through"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            waited = time.monotonic() - self.opened_at
+            if self.state == self.OPEN and waited >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+
+            # half-open: one probe at a time, a lost probe is replaced
+            now = time.monotonic()
+            if self.state == self.HALF_OPEN and (
+                    not self._probing or now - self._probe_started >= self.open_seconds):
+                self._probing = True
+                self._probe_started = now
+                return
+
+            raise CircuitOpen(max(self.open_seconds - waited, 1.0))
+
+    def record(self, failed: bool, elapsed: float = 0.0) -> None:
+        bad = failed or elapsed >= self.slow
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if bad:
+                    self._trip()
+                else:
+                    self.state = self.CLOSED
+                    self._outcomes.clear()
+                self._probing = False
+                return
+
+            if self.state == self.OPEN:
+                return
+
+            self._outcomes.append(bad)
+            if (len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_rate):
+                self._trip()
+
+    def _trip(self) -> None:
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self._outcomes.clear()
+        print(f"[ERROR]\tDatabase circuit breaker opened for {self.open_seconds:.0f}s")
+
+    # SQLAlchemy engine listeners ------------------
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not context.execution_options.get(BREAKER_IGNORE):
+            context._breaker_started = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_breaker_started", None)
+        if started is not None:
+            self.record(False, time.perf_counter() - started)
+
+    def handle_error(self, exception_context) -> None:
+        # connection loss, server errors, lock waits — not constraint violations
+        if exception_context.is_disconnect:
+            self.record(True)
+        elif isinstance(exception_context.sqlalchemy_exception, (OperationalError, InterfaceError)):
+            # the client picks the deadline (`X-Request-Timeout-Ms`): short ones must not open the breaker
+            if not self._deadline_cancelled(exception_context.original_exception):
+                self.record(True)
+
+    @staticmethod
+    def _deadline_cancelled(error: BaseException | None) -> bool:
+        """A statement or lock timeout set from the request deadline fired"""
+        # psycopg 3 / psycopg2
+        sqlstate = getattr(error, "sqlstate", None) or getattr(error, "pgcode", None)
+        left = remaining()
+        return sqlstate in _TIMEOUT_SQLSTATES and left is not None and left <= _DEADLINE_SLACK
@@ -0,0 +1,37 @@
+"""
+Consistent hashing of questions (and their answers) onto DB shards
+
+Shards are identified by their position in the shard list. Appending a shard
+keeps every existing ring point, so only ~1/N of the questions move to it
+(see `core.tools.rebalance`).
+"""
+
+# standard library modules
+import bisect
+import hashlib
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    def __init__(self, n_shards: int, vnodes: int = 256):
+        if n_shards < 1:
+            raise ValueError("At least one shard is needed.")
+
+        self.n_shards = n_shards
+        points = sorted(
+            (_hash(f"shard-{shard}#{vnode}"), shard)
+            for shard in range(n_shards)
+            for vnode in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, question_id: int) -> int:
+        if self.n_shards == 1:
+            return 0
+
+        i = bisect.bisect(self._hashes, _hash(str(question_id)))
+        return self._shards[i % len(self._shards)]
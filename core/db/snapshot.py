@@ -0,0 +1,305 @@
+"""
+Memory-mapped snapshot of hot questions and their answers
+
+Written by `python -m core.tools.snapshot`, read at start up so the first
+`get_question`/`get_answers` calls after a deploy do not all go to the DB.
+The file is columnar: one NumPy array per field, strings as UTF-8 blobs
+with offsets, answers grouped by question. It is mapped read-only, so every
+worker on the host shares the same page cache pages and nothing is parsed
+up front.
+
+Layout
+    MAGIC | header length (uint64) | JSON header | arrays, each 8-byte aligned
+"""
+
+# standard library modules
+import datetime
+import json
+import mmap
+import os
+import threading
+import time
+from typing import Iterable, Mapping, Sequence
+
+# 3rd party modules
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+# local modules
+from core.db.models import Question, Answer
+from core.settings import env
+
+
+MAGIC = b"QASNAP1\n"
+_ALIGN = 8
+
+
+# Writing ----------------------------------------
+def _pack_strings(values: Iterable[str | None]) -> tuple[np.ndarray, np.ndarray]:
+    encoded = [(value or "").encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+
+def _datetimes(values: Iterable[datetime.datetime | None]) -> np.ndarray:
+    # naive, as stored; NaT for missing values
+    return np.array(
+        [value.replace(tzinfo=None) if value else None for value in values],
+        dtype="datetime64[us]"
+    )
+
+
+def write_snapshot(
+        path: str,
+        questions: Sequence[Question],
+        answers: Mapping[int, Sequence[Answer]],
+        taken_at: datetime.datetime | None = None,
+        max_answer_id: int | None = None
+) -> dict[str, int]:
+    """
+    Write `questions` and `answers` (by question id) to `path`, atomically;
+    `max_answer_id` is the largest answer id in the DB when it was read
+    """
+    questions = sorted(questions, key=lambda q: q.id)
+    grouped = [sorted(answers.get(q.id, ()), key=lambda a: a.id) for q in questions]
+    flat = [answer for group in grouped for answer in group]
+    users = sorted({answer.user_id for answer in flat})
+    user_index = {user_id: i for i, user_id in enumerate(users)}
+
+    arrays: dict[str, np.ndarray] = {
+        "q_ids": np.array([q.id for q in questions], dtype=np.int64),
+        "q_created": _datetimes(q.created_at for q in questions),
+        # answers of question i are rows a_start[i]:a_start[i + 1]
+        "a_start": np.concatenate(([0], np.cumsum([len(g) for g in grouped]))).astype(np.int64),
+        "a_ids": np.array([a.id for a in flat], dtype=np.int64),
+        "a_created": _datetimes(a.created_at for a in flat),
+        "a_user": np.array([user_index[a.user_id] for a in flat], dtype=np.int32),
+    }
+    arrays["q_text_offsets"], arrays["q_text"] = _pack_strings(q.text for q in questions)
+    arrays["a_text_offsets"], arrays["a_text"] = _pack_strings(a.text for a in flat)
+    arrays["u_offsets"], arrays["u_ids"] = _pack_strings(users)
+
+    taken_at = taken_at or datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+    if max_answer_id is None:
+        max_answer_id = int(arrays["a_ids"].max()) if len(flat) else 0
+    descriptors: dict[str, list] = {}
+    header = b""
+    # offsets depend on the header length, which depends on the offsets
+    for _ in range(3):
+        position = len(MAGIC) + 8 + len(header)
+        position += -position % _ALIGN
+        for name, array in arrays.items():
+            descriptors[name] = [position, array.dtype.str, len(array)]
+            position += array.nbytes + (-array.nbytes % _ALIGN)
+        header = json.dumps({"taken_at": taken_at.isoformat(), "max_answer_id": max_answer_id,
+                             "arrays": descriptors}).encode()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        for name, array in arrays.items():
+            f.write(b"\0" * (descriptors[name][0] - f.tell()))
+            f.write(array.tobytes())
+    # workers mapping the previous file keep reading it until they reopen
+    os.replace(tmp_path, path)
+
+    return {"questions": len(questions), "answers": len(flat), "users": len(users)}
+
+
+# Reading ----------------------------------------
+class Snapshot:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a snapshot")
+        start = len(MAGIC) + 8
+        header_length = int.from_bytes(self._mmap[len(MAGIC):start], "little")
+        header = json.loads(self._mmap[start:start + header_length])
+
+        self.path = path
+        self.taken_at = datetime.datetime.fromisoformat(header["taken_at"])
+        self.max_answer_id: int = header["max_answer_id"]
+        self._blob_offsets: dict[str, int] = {}
+        for name, (offset, dtype, count) in header["arrays"].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype=dtype, count=count, offset=offset))
+            self._blob_offsets[name] = offset
+
+        self.size = len(self.q_ids)
+        self._user_rows: dict[str, int] | None = None
+
+    def _string(self, blob: str, offsets: np.ndarray, i: int) -> str:
+        base = self._blob_offsets[blob]
+        return self._mmap[base + int(offsets[i]):base + int(offsets[i + 1])].decode()
+
+    @staticmethod
+    def _datetime(value: np.datetime64) -> datetime.datetime | None:
+        return None if np.isnat(value) else value.item()
+
+    def find(self, question_id: int) -> int | None:
+        """Row of the question, None if it is not in the snapshot"""
+        row = int(np.searchsorted(self.q_ids, question_id))
+        if row < self.size and self.q_ids[row] == question_id:
+            return row
+        return None
+
+    def question(self, row: int) -> Question:
+        return Question(
+            id=int(self.q_ids[row]),
+            text=self._string("q_text", self.q_text_offsets, row),
+            created_at=self._datetime(self.q_created[row]),
+        )
+
+    def answers(self, row: int) -> list[Answer]:
+        question_id = int(self.q_ids[row])
+        return [
+            Answer(
+                id=int(self.a_ids[i]),
+                question_id=question_id,
+                user_id=self._string("u_ids", self.u_offsets, int(self.a_user[i])),
+                text=self._string("a_text", self.a_text_offsets, i),
+                created_at=self._datetime(self.a_created[i]),
+            )
+            for i in range(int(self.a_start[row]), int(self.a_start[row + 1]))
+        ]
+
+    def rows_answered_by(self, user_id: str) -> np.ndarray:
+        """Rows of the questions `user_id` answered"""
+        if self._user_rows is None:
+            self._user_rows = {
+                self._string("u_ids", self.u_offsets, i): i for i in range(len(self.u_offsets) - 1)}
+        user = self._user_rows.get(user_id)
+        if user is None:
+            return np.empty(0, dtype=np.int64)
+        answer_rows = np.flatnonzero(self.a_user == user)
+        return np.unique(np.searchsorted(self.a_start, answer_rows, side="right") - 1)
+
+    def close(self) -> None:
+        for name in self._blob_offsets:
+            setattr(self, name, None)
+        try:
+            self._mmap.close()
+        except BufferError:
+            # a view is still referenced somewhere, the mapping goes with it
+            pass
+
+
+class SnapshotCache:
+    """
+    A `Snapshot` served for a warm-up window, from the first read on.
+    Questions written locally, or found changed by `reconcile`, are marked
+    stale and read from the DB again.
+    """
+
+    def __init__(self, snapshot: Snapshot, ttl: float = 600.0, reconcile_every: float = 30.0):
+        self.snapshot = snapshot
+        self.expires_at = time.monotonic() + ttl
+        self.reconcile_every = reconcile_every
+        self.stale = np.zeros(snapshot.size, dtype=bool)
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SnapshotCache | None":
+        path = env("SNAPSHOT_PATH", "")
+        if not path:
+            return None
+
+        try:
+            snapshot = Snapshot(path)
+        except Exception as e:
+            print(f"[ERROR]\tSnapshot not loaded: {e}")
+            return None
+
+        now = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+        age = (now - snapshot.taken_at).total_seconds()
+        if age > env("SNAPSHOT_MAX_AGE", 3600.0):
+            print(f"[ERROR]\tSnapshot not loaded: taken {age:.0f}s ago")
+            snapshot.close()
+            return None
+
+        return cls(
+            snapshot,
+            ttl=env("SNAPSHOT_TTL", 600.0),
+            reconcile_every=env("SNAPSHOT_RECONCILE_S", 30.0),
+        )
+
+    @property
+    def active(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+    def _fresh_row(self, question_id: int) -> int | None:
+        if not self.active:
+            return None
+        row = self.snapshot.find(question_id)
+        if row is None or self.stale[row]:
+            return None
+        return row
+
+    def get_question(self, question_id: int) -> Question | None:
+        """The question if the snapshot can serve it, else None"""
+        row = self._fresh_row(question_id)
+        if row is None:
+            return None
+        self.hits += 1
+        return self.snapshot.question(row)
+
+    def get_answers(self, question_id: int) -> list[Answer] | None:
+        row = self._fresh_row(question_id)
+        if row is None:
+            return None
+        self.hits += 1
+        return self.snapshot.answers(row)
+
+    # Invalidation -----------------------------------
+    def invalidate(self, question_id: int) -> None:
+        row = self.snapshot.find(question_id)
+        if row is not None:
+            self.stale[row] = True
+
+    def invalidate_user(self, user_id: str) -> None:
+        self.stale[self.snapshot.rows_answered_by(user_id)] = True
+
+    def reconcile(self, shards: Sequence[sessionmaker], batch_size: int = 1_000) -> int:
+        """
+        Mark questions that changed since the snapshot was taken as stale:
+        questions answered since (answer ids above `max_answer_id`, a primary
+        key range) and deleted questions (primary key lookups). Answers are
+        not read otherwise, hot questions have the most of them. Returns the
+        number of questions newly marked.
+        """
+        with self._lock:
+            before = int(self.stale.sum())
+            answered: set[int] = set()
+            for shard in shards:
+                with shard.begin() as session:
+                    answered.update(session.execute(
+                        select(Answer.question_id).where(Answer.id > self.snapshot.max_answer_id).distinct()
+                    ).scalars())
+            for question_id in answered:
+                self.invalidate(question_id)
+
+            # only questions still served; mid-rebalance a question may be on either of two shards
+            rows = np.flatnonzero(~self.stale)
+            for start in range(0, len(rows), batch_size):
+                ids = self.snapshot.q_ids[rows[start:start + batch_size]].tolist()
+                found: set[int] = set()
+                for shard in shards:
+                    with shard.begin() as session:
+                        found.update(session.execute(
+                            select(Question.id).where(Question.id.in_(ids))
+                        ).scalars())
+                for question_id in set(ids) - found:
+                    self.invalidate(question_id)
+
+            return int(self.stale.sum()) - before
+
+    def close(self) -> None:
+        self.expires_at = 0.0
+        # waits for a reconcile still reading the arrays
+        with self._lock:
+            self.snapshot.close()
@@ -8,7 +8,21 @@ Main module to run ASGI server with
 from fastapi import FastAPI
 
 # local modules
+from core.db.resilience import DatabaseUnavailable
+from core.main.deadlines import DeadlineMiddleware, StaleResponseMiddleware, database_unavailable_handler
 from core.main.endpoints import router
+from core.main.profiling import PROFILER, QueryProfilerMiddleware
 
 APP = FastAPI()
 APP.include_router(router)
+
+# open DB circuit or lost connection -> 503, expired deadline -> 504
+APP.add_exception_handler(DatabaseUnavailable, database_unavailable_handler)
+if StaleResponseMiddleware.enabled():
+    APP.add_middleware(StaleResponseMiddleware)
+APP.add_middleware(DeadlineMiddleware)
+
+# opt-in, see `core.main.profiling`
+if PROFILER:
+    APP.add_middleware(QueryProfilerMiddleware, profiler=PROFILER)
+    APP.include_router(PROFILER.router)
@@ -0,0 +1,280 @@
+"""
+In-process pub/sub of new answers, served per question as Server-Sent Events
+
+`AnswerBroker` fans every published answer out to the bounded queues of the
+question's subscribers. A subscriber whose queue is full is evicted instead
+of slowing the publisher down, so one stalled client cannot hold up the rest.
+
+With several workers, `PostgresNotifyBridge` publishes through
+`NOTIFY answers` and feeds every worker's broker from `LISTEN answers`.
+"""
+
+# standard library modules
+import asyncio
+import json
+import math
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+# 3rd party modules
+from sqlalchemy import make_url
+
+# local modules
+from core.settings import env
+
+
+class BrokerFull(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, question_id: int, queue_size: int):
+        self.question_id = question_id
+        # pre-encoded SSE frames; `None` marks the end of the stream
+        self.queue: asyncio.Queue[str | None] = asyncio.Queue(maxsize=queue_size)
+        self.evicted = False
+
+    def evict(self) -> None:
+        self.evicted = True
+        # drop the backlog, so the end marker always fits
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class AnswerBroker:
+    def __init__(self, queue_size: int = 64, max_subscribers: int = 10_000, keepalive: float = 15.0):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.keepalive = keepalive
+        self.subscribers: dict[int, set[Subscription]] = {}
+        self.count = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "AnswerBroker":
+        return cls(
+            queue_size=env("ANSWER_STREAM_QUEUE_SIZE", 64),
+            max_subscribers=env("ANSWER_STREAM_MAX_SUBSCRIBERS", 10_000),
+            keepalive=env("ANSWER_STREAM_KEEPALIVE", 15.0),
+        )
+
+    def subscribe(self, question_id: int) -> Subscription:
+        if self.count >= self.max_subscribers:
+            raise BrokerFull(f"{self.count} subscribers already connected")
+
+        subscription = Subscription(question_id, self.queue_size)
+        self.subscribers.setdefault(question_id, set()).add(subscription)
+        self.count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self.subscribers.get(subscription.question_id)
+        if subscribers is None or subscription not in subscribers:
+            return
+
+        subscribers.discard(subscription)
+        self.count -= 1
+        if not subscribers:
+            del self.subscribers[subscription.question_id]
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.max_subscribers
+
+    def has_subscribers(self, question_id: int) -> bool:
+        return question_id in self.subscribers
+
+    def publish(self, question_id: int, answer: dict) -> int:
+        """Queue `answer` for every subscriber of the question; call from the event loop"""
+        subscribers = self.subscribers.get(question_id)
+        if not subscribers:
+            return 0
+
+        # encode once, whatever the number of subscribers
+        frame = f"id: {answer['id']}\nevent: answer\ndata: {json.dumps(answer)}\n\n"
+        delivered = 0
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(frame)
+                delivered += 1
+            except asyncio.QueueFull:
+                subscription.evict()
+                self.unsubscribe(subscription)
+                self.evictions += 1
+
+        return delivered
+
+    async def events(self, question_id: int) -> AsyncIterator[str]:
+        """SSE frames for one subscriber of the question, until it is evicted or disconnects"""
+        # subscribed once the response streams: a client gone before that holds no slot
+        try:
+            subscription = self.subscribe(question_id)
+        except BrokerFull:
+            yield "event: full\ndata: {}\n\n"
+            return
+
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscription.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if frame is None:
+                    yield "event: evicted\ndata: {}\n\n"
+                    break
+                yield frame
+        finally:
+            self.unsubscribe(subscription)
+
+
+class PostgresNotifyBridge:
+    """Multi-worker fan-out through Postgres `LISTEN/NOTIFY`"""
+
+    CHANNEL = "answers"
+    # NOTIFY payloads are capped at 8000 bytes, larger answers are re-read by id
+    MAX_PAYLOAD = 7_000
+
+    def __init__(
+            self,
+            broker: AnswerBroker,
+            db_uri: str,
+            fetch_answer: Callable[[int], Awaitable[dict | None]],
+            timeout: float = 2.0
+    ):
+        self.broker = broker
+        self.dsn = make_url(db_uri).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.fetch_answer = fetch_answer
+        self.timeout = timeout
+        # libpq counts whole seconds, 2 at least
+        self.connect_timeout = max(math.ceil(timeout), 2)
+        self._pending: set[asyncio.Task] = set()
+        self._notify_conn = None
+        self._notify_lock = asyncio.Lock()
+        self._reconnect_at = 0.0
+        self._backoff = 1.0
+        self._listener: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        # psycopg is only needed when the bridge is enabled
+        try:
+            await self._connection()
+        except Exception as e:
+            # `publish` connects again later
+            print(f"[ERROR]\tNOTIFY connection failed: {e}")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+        if self._pending:
+            # answers already committed still go out; each publish is bounded by `timeout`
+            await asyncio.wait(list(self._pending), timeout=2 * self.timeout)
+            for task in self._pending:
+                task.cancel()
+        if self._notify_conn:
+            await self._notify_conn.close()
+
+    def publish_soon(self, question_id: int, answer: dict) -> None:
+        """`publish` in the background: the request that wrote the answer does not wait for Postgres"""
+        task = asyncio.create_task(self.publish(question_id, answer))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def publish(self, question_id: int, answer: dict) -> None:
+        payload = json.dumps(answer)
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            payload = json.dumps({"id": answer["id"], "question_id": question_id})
+
+        try:
+            if await asyncio.wait_for(self._notify(payload), self.timeout):
+                return
+        except asyncio.TimeoutError:
+            print(f"[ERROR]\tNOTIFY timed out after {self.timeout:.1f}s")
+            # a stalled connection would hold up every later answer
+            if self._notify_conn is not None:
+                await self._discard(self._notify_conn)
+
+        # this worker's subscribers still get it
+        self.broker.publish(question_id, answer)
+
+    async def _notify(self, payload: str) -> bool:
+        # a second attempt on a fresh connection, when the first one was lost
+        for _ in range(2):
+            try:
+                conn = await self._connection()
+            except Exception as e:
+                print(f"[ERROR]\tNOTIFY connection failed: {e}")
+                return False
+            try:
+                await conn.execute("SELECT pg_notify(%s, %s)", (self.CHANNEL, payload))
+                return True
+            except Exception as e:
+                print(f"[ERROR]\tNOTIFY failed: {e}")
+                await self._discard(conn)
+        return False
+
+    async def _connection(self):
+        """The NOTIFY connection, reconnected with the same backoff as `_listen`"""
+        import psycopg
+
+        async with self._notify_lock:
+            if self._notify_conn is not None and not self._notify_conn.closed:
+                return self._notify_conn
+
+            if time.monotonic() < self._reconnect_at:
+                raise ConnectionError(f"reconnecting in {self._reconnect_at - time.monotonic():.0f}s")
+            try:
+                self._notify_conn = await psycopg.AsyncConnection.connect(
+                    self.dsn, autocommit=True, connect_timeout=self.connect_timeout)
+            except Exception:
+                self._reconnect_at = time.monotonic() + self._backoff
+                self._backoff = min(self._backoff * 2, 30.0)
+                raise
+
+            self._backoff = 1.0
+            return self._notify_conn
+
+    async def _discard(self, conn) -> None:
+        # no lock: it may be held by a stalled connect
+        if self._notify_conn is conn:
+            self._notify_conn = None
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def _listen(self) -> None:
+        import psycopg
+
+        backoff = 1.0
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(
+                        self.dsn, autocommit=True, connect_timeout=self.connect_timeout) as conn:
+                    await conn.execute(f"LISTEN {self.CHANNEL}")
+                    backoff = 1.0
+                    async for notify in conn.notifies():
+                        await self._deliver(json.loads(notify.payload))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR]\tLISTEN {self.CHANNEL} failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+
+    async def _deliver(self, answer: dict) -> None:
+        question_id = answer["question_id"]
+        if not self.broker.has_subscribers(question_id):
+            return
+
+        if "text" not in answer:
+            answer = await self.fetch_answer(answer["id"])
+            if answer is None:
+                return
+
+        self.broker.publish(question_id, answer)
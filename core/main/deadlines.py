@@ -0,0 +1,135 @@
+"""
+Request deadlines, fail-fast responses and stale reads while the DB breaker is open
+
+Clients may shorten the request deadline with an `X-Request-Timeout-Ms` header.
+"""
+
+# standard library modules
+import time
+from collections import OrderedDict
+
+# 3rd party modules
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+# local modules
+from core.db.resilience import CircuitOpen, DatabaseUnavailable, DeadlineExceeded, reset_deadline, set_deadline
+from core.settings import env
+
+
+CIRCUIT_OPEN_HEADER = b"x-circuit-open"
+
+
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable) -> JSONResponse:
+    if isinstance(exc, CircuitOpen):
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"detail": f"[ERROR]\t{exc}"},
+                            headers={"Retry-After": str(int(exc.retry_after)),
+                                     CIRCUIT_OPEN_HEADER.decode(): "1"})
+
+    if isinstance(exc, DeadlineExceeded):
+        return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                            content={"detail": f"[ERROR]\t{exc}"})
+
+    # e.g. connection lost at COMMIT: not a timeout, and the outcome is unknown
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        content={"detail": f"[ERROR]\t{exc}"})
+
+
+class DeadlineMiddleware:
+    def __init__(self, app, default_ms: float | None = None):
+        self.app = app
+        self.default_ms = default_ms if default_ms is not None else env("REQUEST_DEADLINE_MS", 10_000.0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline_ms = self.default_ms
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout-ms":
+                try:
+                    # clients may shorten the deadline, never extend it
+                    deadline_ms = min(float(value), deadline_ms)
+                except ValueError:
+                    pass
+                break
+
+        token = set_deadline(deadline_ms / 1000)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_deadline(token)
+
+
+class StaleResponseMiddleware:
+    """Remember good GET JSON responses, replay them when the breaker is open"""
+
+    def __init__(self, app, max_entries: int | None = None, max_bytes: int | None = None):
+        self.app = app
+        self.max_entries = max_entries or env("STALE_CACHE_SIZE", 1_000)
+        self.max_bytes = max_bytes or env("STALE_MAX_BYTES", 1 << 20)
+        # key -> (stored at, start message headers, body)
+        self.responses: OrderedDict[bytes, tuple[float, list, bytes]] = OrderedDict()
+
+    @staticmethod
+    def enabled() -> bool:
+        return env("STALE_ON_OPEN_CIRCUIT", True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        key = scope["path"].encode() + b"?" + scope.get("query_string", b"")
+        state = {"mode": "pass", "headers": [], "body": [], "size": 0}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                is_json = any(n == b"content-type" and v.startswith(b"application/json")
+                              for n, v in headers)
+
+                if message["status"] == 503 and key in self.responses and any(
+                        n == CIRCUIT_OPEN_HEADER for n, _ in headers):
+                    state["mode"] = "stale"
+                    await self._replay(key, send)
+                    return
+                if message["status"] == 200 and is_json:
+                    state["mode"] = "record"
+                    state["headers"] = headers
+
+            elif message["type"] == "http.response.body":
+                if state["mode"] == "stale":
+                    return
+                if state["mode"] == "record":
+                    chunk = message.get("body", b"")
+                    state["body"].append(chunk)
+                    state["size"] += len(chunk)
+                    if state["size"] > self.max_bytes:
+                        state["mode"], state["body"] = "pass", []
+                    elif not message.get("more_body", False):
+                        self._store(key, state["headers"], b"".join(state["body"]))
+
+            await send(message)
+
+        await self.app(scope, receive, capture)
+
+    def _store(self, key: bytes, headers: list, body: bytes) -> None:
+        self.responses[key] = (time.time(), headers, body)
+        self.responses.move_to_end(key)
+        while len(self.responses) > self.max_entries:
+            self.responses.popitem(last=False)
+
+    async def _replay(self, key: bytes, send) -> None:
+        stored_at, headers, body = self.responses[key]
+        age = int(time.time() - stored_at)
+        headers = [(n, v) for n, v in headers if n != b"content-length"] + [
+            (b"content-length", str(len(body)).encode()),
+            (b"age", str(age).encode()),
+            (b"warning", b'110 - "Response is Stale"'),
+            (b"x-stale", b"1"),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
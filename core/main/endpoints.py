@@ -1,31 +1,117 @@
 # standard library modules
+import asyncio
+import inspect
 import os
 import sys
+import time
 from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 # 3rd party modules
-from fastapi import APIRouter, status
-from fastapi.responses import JSONResponse
-from pydantic import ValidationError
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import Annotated
 
 # local modules
 from core.db import models
-from core.db.queries import QueriesApp
+from core.db.queries import QueriesApp, UnitOfWork
+from core.db.resilience import CircuitBreaker, CircuitOpen, DatabaseUnavailable
+from core.db.snapshot import SnapshotCache
+from core.main.broker import AnswerBroker, PostgresNotifyBridge
+from core.main.jobs import Job, JobQueueFull, JobRegistry, delete_in_batches
+from core.main.profiling import PROFILER
+from core.main.similarity import DUPLICATE_THRESHOLD, QuestionIndex, index_from_env
+from core.settings import env
 from core.validation_models import datamodels as datamodels
 
 
 db_client: QueriesApp | None = None
+answer_broker: AnswerBroker = AnswerBroker.from_env()
+answer_bridge: PostgresNotifyBridge | None = None
+question_index: QuestionIndex | None = index_from_env()
+delete_jobs: JobRegistry = JobRegistry.from_env()
+
+
+async def _load_question_index() -> None:
+    """Build the related questions index off the event loop, retrying until the DB answers"""
+    delay = 1.0
+    while True:
+        try:
+            questions: list[models.Question] | None = await asyncio.to_thread(db_client.get_all_questions)
+            if questions is None:
+                raise Exception("Unexpected DB response")
+            await asyncio.to_thread(question_index.load, [(q.id, q.text) for q in questions])
+            print(f"[INFO]\tRelated questions index: {question_index.size} questions")
+            return
+        except Exception as e:
+            wait = e.retry_after if isinstance(e, CircuitOpen) else delay
+            print(f"[ERROR]\tRelated questions index not loaded, retrying in {wait:.0f}s: {e}")
+            await asyncio.sleep(wait)
+            delay = min(delay * 2, 60.0)
+
+
+async def _serve_snapshot(snapshot: SnapshotCache) -> None:
+    """Look for changes to the warm-up snapshot's questions until it expires, then drop it"""
+    try:
+        while snapshot.active:
+            try:
+                stale = await asyncio.to_thread(snapshot.reconcile, db_client.shards)
+                if stale:
+                    print(f"[INFO]\tSnapshot: {stale} changed questions no longer served")
+            except Exception as e:
+                print(f"[ERROR]\t{e}")
+            await asyncio.sleep(min(snapshot.reconcile_every,
+                                    max(snapshot.expires_at - time.monotonic(), 0)))
+    finally:
+        db_client.snapshot = None
+        snapshot.close()
+        print(f"[INFO]\tSnapshot expired after {snapshot.hits} reads")
 
 @asynccontextmanager
 async def start_and_stop_engine(rout: APIRouter = None):
-    global db_client
+    global db_client, answer_bridge
+    snapshot_task: asyncio.Task | None = None
+    index_task: asyncio.Task | None = None
     db_uri = os.getenv("DB_URI")
     if db_uri is None:
         sys.exit("[ERROR]\tDB_URI not set.")
-    db_client = QueriesApp(db_uri=db_uri)
+    # optional question shards, whitespace separated; see `core.tools.rebalance`
+    shard_uris = env("DB_SHARD_URIS", "").split() or None
+    db_client = QueriesApp(db_uri=db_uri, breaker=CircuitBreaker.from_env(),
+                           shard_uris=shard_uris,
+                           previous_shards=env("DB_PREVIOUS_SHARD_COUNT", 0) or None)
+    if PROFILER:
+        PROFILER.instrument(db_client)
+
+    # warm-up reads from a memory-mapped snapshot; see `core.tools.snapshot`
+    snapshot = SnapshotCache.from_env()
+    if snapshot:
+        db_client.snapshot = snapshot
+        snapshot_task = asyncio.create_task(_serve_snapshot(snapshot))
+
+    # multi-worker answer streams
+    if env("ANSWER_STREAM_NOTIFY", False) and db_client.engine.dialect.name == "postgresql":
+        answer_bridge = PostgresNotifyBridge(answer_broker, db_uri, _fetch_answer,
+                                             timeout=env("ANSWER_STREAM_NOTIFY_TIMEOUT", 2.0))
+        await answer_bridge.start()
+
+    await delete_jobs.start()
+
+    # built in the background; related/duplicate lookups wait for `ready`
+    if question_index:
+        index_task = asyncio.create_task(_load_question_index())
 
     yield
 
+    await delete_jobs.stop()
+    for task in (snapshot_task, index_task):
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if answer_bridge:
+        await answer_bridge.stop()
     db_client.close()
 
 
@@ -34,25 +120,112 @@ router = APIRouter(
 )
 
 
+# Request-scoped unit of work ---------------------------------------
+async def get_unit_of_work() -> AsyncIterator[UnitOfWork]:
+    """One session and transaction per request, committed before the response is sent"""
+    uow = UnitOfWork()
+    try:
+        yield uow
+        # rolled back instead when a `QueriesApp` call failed
+        committed = db_client.commit(uow)
+    except Exception:
+        uow.rollback()
+        raise
+    finally:
+        uow.close()
+
+    if not committed:
+        if not uow.failed:
+            # the endpoint reported success, but nothing was kept
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="[ERROR]\tCommit failed")
+        return
+
+    # e.g. live answer streams: only what was committed goes out
+    for callback in uow.after_commit:
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+
+
+DbSession = Annotated[UnitOfWork, Depends(get_unit_of_work, scope="function")]
+
+
+# Answer stream helpers ---------------------------------------------
+async def _fetch_answer(answer_id: int) -> dict | None:
+    answer: models.Answer | None = await asyncio.to_thread(db_client.get_answer, answer_id)
+    if answer is None:
+        return None
+    return datamodels.Answer.model_validate(answer).model_dump(mode="json")
+
+
+def _publish_answer(answer: models.Answer) -> None:
+    if answer_bridge is None and not answer_broker.has_subscribers(answer.question_id):
+        return
+
+    payload = datamodels.Answer.model_validate(answer).model_dump(mode="json")
+    if answer_bridge:
+        answer_bridge.publish_soon(answer.question_id, payload)
+    else:
+        answer_broker.publish(answer.question_id, payload)
+
+
+# Background deletes -------------------------------------------------
+def _accept_job(kind: str, target: int | str, run) -> JSONResponse:
+    try:
+        job = delete_jobs.submit(kind, target, run)
+    except JobQueueFull as e:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"detail": f"[ERROR]\t{e}"})
+
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                        content={"ok": True, "status_code": 202, "job_id": job.id},
+                        headers={"Location": f"/jobs/{job.id}"})
+
+
+# Request payloads: validated once, straight from the raw body ---------
+def _body_schema(adapter: TypeAdapter) -> dict:
+    """OpenAPI request body for endpoints reading the raw body"""
+    return {"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": adapter.json_schema()}}
+    }}
+
+
+async def _validate_body(request: Request, adapter: TypeAdapter) -> dict:
+    try:
+        return adapter.validate_json(await request.body())
+    except ValidationError as ve:
+        # same 422 response FastAPI gives for declared body models
+        raise RequestValidationError([
+            error | {"loc": ("body", *error["loc"])}
+            for error in ve.errors(include_url=False)
+        ])
+
+
 @router.get(path="/", tags=["home"])
 async def home() -> JSONResponse:
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"ok": True, "status_code": 200})
 
 
-@router.post(path="/new_user", tags=["users"])
-async def create_user(user: datamodels.User) -> JSONResponse:
+@router.post(path="/new_user", tags=["users"],
+             openapi_extra=_body_schema(datamodels.USER_PAYLOAD))
+async def create_user(request: Request, uow: DbSession) -> JSONResponse:
+    user = await _validate_body(request, datamodels.USER_PAYLOAD)
 
     try:
-        user_orm = db_client.convert_model_to_orm(user, models.User)
+        user_orm = models.User(**user)
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail":f"[ERROR]\t{e}"})
 
     try:
-        db_response: bool = db_client.create_user(user_orm)
+        db_response: bool = db_client.create_user(user_orm, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
@@ -62,12 +235,26 @@ async def create_user(user: datamodels.User) -> JSONResponse:
 
 
 @router.delete(path="/delete_user/{user_id}", tags=["users"])
-async def delete_user_by_id(user_id: str) -> JSONResponse:
+async def delete_user_by_id(user_id: str, uow: DbSession, background: bool = False) -> JSONResponse:
+    """With `background`, 202 and a job deleting the user's answers in batches"""
+
+    if background:
+        if not db_client.get_user(user_id, uow=uow):
+            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                content={"detail": "[ERROR]\tUser not found"})
+
+        def run(job: Job) -> None:
+            delete_in_batches(job, db_client, lambda: db_client.delete_user(user_id),
+                              delete_jobs.batch_size, delete_jobs.batch_pause, user_id=user_id)
+
+        return _accept_job("delete_user", user_id, run)
 
     try:
-        db_response: bool = db_client.delete_user(user_id)
+        db_response: bool = db_client.delete_user(user_id, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
@@ -78,10 +265,10 @@ async def delete_user_by_id(user_id: str) -> JSONResponse:
 
 # Questions ------------
 @router.get(path="/questions", tags=["questions"])
-async def get_all_questions() -> list[datamodels.Question]:
+async def get_all_questions(uow: DbSession) -> list[datamodels.Question]:
     """"""
 
-    qs: list[models.Question] | None = db_client.get_all_questions()
+    qs: list[models.Question] | None = db_client.get_all_questions(uow=uow)
     if qs:
         for i in range(len(qs)):
             try:
@@ -94,37 +281,64 @@ async def get_all_questions() -> list[datamodels.Question]:
         return []
 
 
-@router.post(path="/questions", tags=["questions"])
-async def post_one_question(question: datamodels.Question) -> JSONResponse:
-    """"""
+@router.post(path="/questions", tags=["questions"],
+             openapi_extra=_body_schema(datamodels.QUESTION_PAYLOAD))
+async def post_one_question(
+        request: Request,
+        uow: DbSession,
+        allow_duplicate: bool = False
+) -> JSONResponse:
+    """Rejects near-duplicates of existing questions with 409 unless `allow_duplicate`"""
+    question = await _validate_body(request, datamodels.QUESTION_PAYLOAD)
+
+    if question_index and question_index.ready and not allow_duplicate:
+        duplicates = question_index.similar_to(question["text"], k=5, min_score=DUPLICATE_THRESHOLD)
+        # the index only sees this worker's writes: drop questions deleted elsewhere
+        for duplicate in list(duplicates):
+            if db_client.get_question(duplicate["id"], uow=uow) is None:
+                if uow.failed:
+                    return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                        content={"detail": "[ERROR]\tUnexpected DB response"})
+                question_index.remove(duplicate["id"])
+                duplicates.remove(duplicate)
+        if duplicates:
+            return JSONResponse(status_code=status.HTTP_409_CONFLICT,
+                                content={"detail": "[ERROR]\tDuplicate question",
+                                         "duplicates": duplicates})
 
     try:
-        question_orm = db_client.convert_model_to_orm(question, models.Question)
+        question_orm = models.Question(**question)
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail":f"[ERROR]\t{e}"})
 
     try:
-        db_response: bool = db_client.create_question(question_orm)
+        db_response: bool = db_client.create_question(question_orm, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
 
+    if question_index:
+        uow.after_commit.append(lambda: question_index.add(question_orm.id, question_orm.text))
+
     return JSONResponse(status_code=status.HTTP_201_CREATED,
                         content={"ok": True, "status_code": 201})
 
 
 @router.get(path="/questions/{question_id}", tags=["questions"])
 async def get_question_and_all_answers_by_id(
-        question_id: int
+        question_id: int,
+        uow: DbSession
 ) -> tuple[datamodels.Question | None, list[datamodels.Answer] | None]:
     """"""
-    question: models.Question | None = db_client.get_question(question_id)
+    question: models.Question | None = db_client.get_question(question_id, uow=uow)
 
     if question:
-        answers: list[models.Answer | None] = db_client.get_answers(question_id)
+        answers: list[models.Answer | None] = db_client.get_answers(question_id, uow=uow)
         for i in range(len(answers)):
             try:
                 answers[i] = datamodels.Answer.model_validate(
@@ -137,62 +351,127 @@ async def get_question_and_all_answers_by_id(
     return None, None
 
 
+@router.get(path="/questions/{question_id}/related", tags=["questions"])
+async def get_related_questions(
+        question_id: int,
+        k: Annotated[int, Query(ge=1, le=100)] = 10
+) -> list[dict]:
+    """Ids and similarity scores (0..1) of the `k` most similar questions"""
+
+    if question_index is None or not question_index.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"detail": "[ERROR]\tRelated questions index not ready"})
+
+    related = question_index.related(question_id, k)
+    if related is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"detail": "[ERROR]\tQuestion not found"})
+
+    return related
+
+
 @router.delete(path="/questions/{question_id}", tags=["questions"])
 async def delete_question_and_all_answers_by_id(
-        question_id: int
+        question_id: int,
+        uow: DbSession,
+        background: bool = False
 ) -> JSONResponse:
-    """"""
+    """With `background`, 202 and a job deleting the answers in batches"""
+
+    if background:
+        if not db_client.get_question(question_id, uow=uow):
+            return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                                content={"detail": "[ERROR]\tQuestion not found"})
+
+        def run(job: Job) -> None:
+            delete_in_batches(job, db_client, lambda: db_client.delete_question(question_id),
+                              delete_jobs.batch_size, delete_jobs.batch_pause, question_id=question_id)
+            if question_index and not job.cancelled:
+                question_index.remove(question_id)
+
+        return _accept_job("delete_question", question_id, run)
 
     try:
         # on delete cascade is EXPECTED on DB Backend
-        db_response: bool = db_client.delete_question(question_id)
+        db_response: bool = db_client.delete_question(question_id, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
 
+    if question_index:
+        uow.after_commit.append(lambda: question_index.remove(question_id))
+
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"ok": True, "status_code": 200})
 # ----------------------
 
 # Answers --------------
 
-@router.post(path="/questions/{question_id}/answers", tags=["answers"])
+@router.post(path="/questions/{question_id}/answers", tags=["answers"],
+             openapi_extra=_body_schema(datamodels.ANSWER_PAYLOAD))
 async def post_answer_by_question_id(
         question_id: int,
-        answer: datamodels.Answer
+        request: Request,
+        uow: DbSession
 ) -> JSONResponse:
     """"""
+    answer = await _validate_body(request, datamodels.ANSWER_PAYLOAD)
 
     try:
-        _answer = datamodels.Answer.model_validate(
-            answer.model_dump() | {"question_id": question_id})
-        answer_orm = db_client.convert_model_to_orm(_answer, models.Answer)
+        answer["question_id"] = question_id
+        answer_orm = models.Answer(**answer)
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail":f"[ERROR]\t{e}"})
 
     try:
-        db_response: bool = db_client.create_answer(answer_orm)
+        db_response: bool = db_client.create_answer(answer_orm, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
 
+    uow.after_commit.append(lambda: _publish_answer(answer_orm))
+
     return JSONResponse(status_code=status.HTTP_201_CREATED,
                         content={"ok": True, "status_code": 201})
 
 
+@router.get(path="/questions/{question_id}/stream", tags=["answers"])
+async def stream_answers_by_question_id(question_id: int, uow: DbSession):
+    """Server-Sent Events: one `answer` event per new answer to the question"""
+
+    if not db_client.get_question(question_id, uow=uow):
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"detail": "[ERROR]\tQuestion not found"})
+
+    if answer_broker.full:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={"detail": f"[ERROR]\t{answer_broker.count} subscribers already connected"})
+
+    # subscribes once streaming starts, see `AnswerBroker.events`
+    return StreamingResponse(answer_broker.events(question_id),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @router.get(path="/answers/{answer_id}", tags=["answers"])
-async def get_answer_by_id(answer_id: int):
+async def get_answer_by_id(answer_id: int, uow: DbSession):
     """"""
 
     try:
-        db_response = db_client.get_answer(answer_id)
+        db_response = db_client.get_answer(answer_id, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail":f"[ERROR]\t{e}"})
@@ -203,14 +482,17 @@ async def get_answer_by_id(answer_id: int):
 
 @router.delete(path="/answers/{answer_id}", tags=["answers"])
 async def delete_answer_by_id(
-        answer_id: int
+        answer_id: int,
+        uow: DbSession
 ) -> JSONResponse:
     """"""
 
     try:
-        db_response = db_client.delete_answer(answer_id)
+        db_response = db_client.delete_answer(answer_id, uow=uow)
         if not db_response:
             raise Exception("Unexpected DB response")
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return JSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             content={"detail": f"[ERROR]\t{e}"})
@@ -218,3 +500,17 @@ async def delete_answer_by_id(
     return JSONResponse(status_code=status.HTTP_200_OK,
                         content={"ok": True, "status_code": 200})
 # ----------------------
+
+
+# Jobs -----------------
+@router.get(path="/jobs/{job_id}", tags=["jobs"])
+async def get_job_by_id(job_id: str):
+    """Status and progress (`done` of `total` answers) of a background delete"""
+
+    job = delete_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"detail": "[ERROR]\tJob not found"})
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=job.to_dict())
+# ----------------------
@@ -0,0 +1,192 @@
+"""
+In-process background jobs for deletes with a large fan-out
+
+`DELETE /delete_user/{user_id}?background=true` and
+`DELETE /questions/{question_id}?background=true` answer `202` with a job id
+right away. A worker then deletes the answers in bounded batches, each in a
+short transaction of its own and off the event loop, and the parent row
+last. Progress is served at `GET /jobs/{job_id}`.
+
+Jobs live in the worker that accepted them: with several workers, poll the
+status from the same one, and resubmit jobs lost to a restart, deleting
+again is harmless.
+"""
+
+# standard library modules
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable
+
+# local modules
+from core.db.queries import QueriesApp
+from core.db.resilience import CircuitOpen, DatabaseUnavailable
+from core.settings import env
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+    def __init__(self, kind: str, target: int | str, run: Callable[["Job"], None]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.target = target
+        self.run = run
+
+        self.status = self.QUEUED
+        # answers to delete when the job started, and deleted so far
+        self.total: int | None = None
+        self.done = 0
+        self.error: str | None = None
+        self.cancelled = False
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "target": self.target,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobRegistry:
+    def __init__(
+            self,
+            workers: int = 1,
+            queue_size: int = 1_000,
+            history: int = 1_000,
+            batch_size: int = 1_000,
+            batch_pause: float = 0.0,
+            max_retries: int = 5,
+            retry_backoff: float = 1.0
+    ):
+        self.n_workers = workers
+        self.history = history
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.jobs: OrderedDict[str, Job] = OrderedDict()
+        self._queue: asyncio.Queue[Job] = asyncio.Queue(maxsize=queue_size)
+        self._workers: list[asyncio.Task] = []
+
+    @classmethod
+    def from_env(cls) -> "JobRegistry":
+        return cls(
+            workers=env("JOB_WORKERS", 1),
+            queue_size=env("JOB_QUEUE_SIZE", 1_000),
+            history=env("JOB_HISTORY", 1_000),
+            batch_size=env("JOB_BATCH_SIZE", 1_000),
+            batch_pause=env("JOB_BATCH_PAUSE_MS", 0.0) / 1000,
+        )
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def submit(self, kind: str, target: int | str, run: Callable[[Job], None]) -> Job:
+        """Queue `run(job)`, to be called in a thread"""
+        job = Job(kind, target, run)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"{self._queue.qsize()} jobs already waiting")
+
+        self.jobs[job.id] = job
+        self._forget_finished()
+        return job
+
+    def _forget_finished(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    # Workers ----------------------------------------
+    async def start(self) -> None:
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.n_workers)]
+
+    async def stop(self) -> None:
+        # running jobs stop after their current batch; queued ones are dropped
+        for job in self.jobs.values():
+            if job.finished_at is None:
+                job.cancelled = True
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.cancelled:
+                continue
+
+            job.status = Job.RUNNING
+            job.started_at = time.time()
+            try:
+                await self._run(job)
+                job.status = Job.CANCELLED if job.cancelled else Job.DONE
+            except asyncio.CancelledError:
+                job.status = Job.CANCELLED
+                raise
+            except Exception as e:
+                print(f"[ERROR]\t{e}")
+                job.status = Job.FAILED
+                job.error = f"[ERROR]\t{e}"
+            finally:
+                job.finished_at = time.time()
+
+    async def _run(self, job: Job) -> None:
+        # every step can be repeated, so an unavailable DB (open breaker, lost
+        # connection, timeout) is waited out
+        for attempt in range(self.max_retries + 1):
+            try:
+                await asyncio.to_thread(job.run, job)
+                return
+            except DatabaseUnavailable as e:
+                if attempt == self.max_retries:
+                    raise
+                job.error = f"[ERROR]\t{e}"
+                await asyncio.sleep(
+                    e.retry_after if isinstance(e, CircuitOpen) else self.retry_backoff * 2 ** attempt)
+
+
+def delete_in_batches(
+        job: Job,
+        db_client: QueriesApp,
+        delete_parent: Callable[[], bool],
+        batch_size: int,
+        batch_pause: float = 0.0,
+        question_id: int | None = None,
+        user_id: str | None = None
+) -> None:
+    """Delete the answers of a question or a user batch by batch, then the parent"""
+    if job.total is None:
+        job.total = db_client.count_answers(question_id=question_id, user_id=user_id)
+
+    while not job.cancelled:
+        deleted = db_client.delete_answers_batch(batch_size, question_id=question_id, user_id=user_id)
+        if deleted is None:
+            raise Exception("Unexpected DB response")
+        if not deleted:
+            break
+        job.done += deleted
+        if batch_pause:
+            time.sleep(batch_pause)
+    else:
+        return
+
+    if not delete_parent():
+        raise Exception("Unexpected DB response")
@@ -0,0 +1,278 @@
+"""
+Opt-in per-request query profiler and N+1 detector
+
+Enable with `QUERY_PROFILER=1`. Every request then gets
+    X-DB-Statements, X-DB-Time-Ms, X-DB-Sessions, X-DB-Transactions
+response headers (plus X-DB-Flags when it looks suspicious), and the latest
+profiles are kept in a ring buffer served at `GET /internal/profiler`. They
+hold raw SQL and query plans, so only loopback clients get them, or, when
+`PROFILER_TOKEN` is set, only clients sending it as a bearer token.
+"""
+
+# standard library modules
+import ipaddress
+import re
+import secrets
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+# 3rd party modules
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy import Engine, event
+
+# local modules
+from core.db.queries import QueriesApp
+from core.settings import env
+
+
+_current_profile: ContextVar["RequestProfile | None"] = ContextVar("current_profile", default=None)
+
+# bound parameters (qmark, named, pyformat, numeric) and numeric literals
+_PARAM = r"(?:\?|:\w+|%\(\w+\)s|%s|\$\d+|\b\d+\b)"
+_PARAM_LIST = re.compile(rf"{_PARAM}(?:\s*,\s*{_PARAM})+")
+_PARAM_ONE = re.compile(_PARAM)
+_SPACES = re.compile(r"\s+")
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def statement_shape(statement: str) -> str:
+    """Statement with parameters, literals and IN-lists collapsed"""
+    shape = _PARAM_LIST.sub("?...", statement)
+    shape = _PARAM_ONE.sub("?", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.time()
+        self.duration_ms: float = 0.0
+        self.status_code: int | None = None
+
+        self.statements = 0
+        self.db_time = 0.0
+        self.sessions = 0
+        self.transactions = 0
+        # per database: a sharded fan-out opens one transaction on each
+        self.db_transactions: Counter[Engine] = Counter()
+        self.shapes: Counter[str] = Counter()
+        self.slow: list[dict] = []
+        self.flags: list[str] = []
+        # shard queries of one request run in `QueriesApp._fan_out` threads
+        self.lock = threading.Lock()
+
+    def add_statement(self, statement: str, elapsed: float, slow: dict | None = None) -> None:
+        shape = statement_shape(statement)
+        with self.lock:
+            self.statements += 1
+            self.db_time += elapsed
+            self.shapes[shape] += 1
+            if slow is not None:
+                self.slow.append(slow)
+
+    def add_session(self) -> None:
+        with self.lock:
+            self.sessions += 1
+
+    def add_transaction(self, database: Engine) -> None:
+        with self.lock:
+            self.transactions += 1
+            self.db_transactions[database] += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "method": self.method,
+                "path": self.path,
+                "started": self.started,
+                "duration_ms": round(self.duration_ms, 3),
+                "status_code": self.status_code,
+                "statements": self.statements,
+                "db_time_ms": round(self.db_time * 1000, 3),
+                "sessions": self.sessions,
+                "transactions": self.transactions,
+                "repeated": {shape: n for shape, n in self.shapes.items() if n > 1},
+                "slow": list(self.slow),
+                "flags": list(self.flags),
+            }
+
+
+class QueryProfiler:
+    def __init__(
+            self,
+            max_statements: int = 10,
+            max_transactions: int = 1,
+            repeat_threshold: int = 3,
+            slow_ms: float = 100.0,
+            explain: bool = False,
+            buffer_size: int = 500,
+            token: str = ""
+    ):
+        self.max_statements = max_statements
+        self.max_transactions = max_transactions
+        self.repeat_threshold = repeat_threshold
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.profiles: deque[dict] = deque(maxlen=buffer_size)
+        self.token = token
+
+        self.router = APIRouter(prefix="/internal", tags=["internal"])
+        self.router.add_api_route("/profiler", self.recent, methods=["GET"],
+                                  dependencies=[Depends(self.authorize)])
+
+    @classmethod
+    def from_env(cls) -> "QueryProfiler | None":
+        if not env("QUERY_PROFILER", False):
+            return None
+
+        return cls(
+            max_statements=env("PROFILER_MAX_STATEMENTS", 10),
+            max_transactions=env("PROFILER_MAX_TRANSACTIONS", 1),
+            repeat_threshold=env("PROFILER_REPEAT_THRESHOLD", 3),
+            slow_ms=env("PROFILER_SLOW_MS", 100.0),
+            explain=env("PROFILER_EXPLAIN", False),
+            buffer_size=env("PROFILER_BUFFER_SIZE", 500),
+            token=env("PROFILER_TOKEN", ""),
+        )
+
+    def authorize(self, request: Request) -> None:
+        """Profiles hold raw SQL and plans: loopback clients, or the bearer token when one is set"""
+        if self.token:
+            scheme, _, token = request.headers.get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and secrets.compare_digest(token.encode(), self.token.encode()):
+                return
+        elif request.client is not None and _is_loopback(request.client.host):
+            return
+
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="[ERROR]\tProfiler access denied")
+
+    async def recent(self, flagged: bool = False, limit: int = 100) -> list[dict]:
+        profiles = [p for p in reversed(self.profiles) if p["flags"] or not flagged]
+        return profiles[:limit]
+
+    # SQLAlchemy instrumentation -------------------
+    def instrument(self, db_client: QueriesApp) -> None:
+        for engine in db_client.engines:
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        for maker in db_client.sessionmakers:
+            event.listen(maker, "after_transaction_create", self._after_transaction_create)
+            event.listen(maker, "after_begin", self._after_begin)
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_profile.get() is not None:
+            context._profiler_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        profile = _current_profile.get()
+        started = getattr(context, "_profiler_started", None)
+        if profile is None or started is None:
+            return
+
+        elapsed = time.perf_counter() - started
+        slow = None
+        if elapsed * 1000 >= self.slow_ms:
+            slow = {"statement": statement, "duration_ms": round(elapsed * 1000, 3)}
+            if self.explain and conn.dialect.name == "postgresql" and not executemany:
+                slow["plan"] = self._explain(conn, statement, parameters)
+        profile.add_statement(statement, elapsed, slow)
+
+    @staticmethod
+    def _explain(conn, statement: str, parameters) -> str | None:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return None
+
+        # raw DBAPI cursor: no SQLAlchemy events, savepoint keeps a failed
+        # EXPLAIN from aborting the caller's transaction
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT profiler_explain")
+            try:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                cursor.execute("RELEASE SAVEPOINT profiler_explain")
+                return plan
+            except Exception as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT profiler_explain")
+                return f"[ERROR]\t{e}"
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _after_transaction_create(session, transaction):
+        profile = _current_profile.get()
+        if profile is not None and transaction.parent is None:
+            profile.add_session()
+
+    @staticmethod
+    def _after_begin(session, transaction, connection):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.add_transaction(connection.engine)
+
+    # Request bookkeeping --------------------------
+    def flag(self, profile: RequestProfile) -> None:
+        with profile.lock:
+            if profile.statements > self.max_statements:
+                profile.flags.append(f"statements>{self.max_statements}")
+            if max(profile.db_transactions.values(), default=0) > self.max_transactions:
+                profile.flags.append(f"transactions>{self.max_transactions}")
+            if any(n >= self.repeat_threshold for n in profile.shapes.values()):
+                profile.flags.append("repeated-statement")
+            if profile.slow:
+                profile.flags.append("slow-statement")
+
+    def headers(self, profile: RequestProfile) -> list[tuple[bytes, bytes]]:
+        headers = [
+            (b"x-db-statements", str(profile.statements).encode()),
+            (b"x-db-time-ms", f"{profile.db_time * 1000:.3f}".encode()),
+            (b"x-db-sessions", str(profile.sessions).encode()),
+            (b"x-db-transactions", str(profile.transactions).encode()),
+        ]
+        if profile.flags:
+            headers.append((b"x-db-flags", ",".join(profile.flags).encode()))
+        return headers
+
+
+class QueryProfilerMiddleware:
+    """Pure ASGI middleware, so streamed responses are not buffered"""
+
+    def __init__(self, app, profiler: QueryProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.profiler.router.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"])
+        token = _current_profile.set(profile)
+        started = time.perf_counter()
+
+        async def send_with_profile(message):
+            if message["type"] == "http.response.start":
+                profile.status_code = message["status"]
+                self.profiler.flag(profile)
+                message["headers"] = list(message.get("headers", [])) + self.profiler.headers(profile)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _current_profile.reset(token)
+            profile.duration_ms = (time.perf_counter() - started) * 1000
+            self.profiler.profiles.append(profile.to_dict())
+
+
+PROFILER: QueryProfiler | None = QueryProfiler.from_env()
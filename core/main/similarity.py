@@ -0,0 +1,220 @@
+"""
+In-memory MinHash index over `Question.text` for related and duplicate questions
+
+Each question is reduced to a MinHash signature of its word unigrams and
+bigrams. Signatures are split into LSH bands: a lookup compares the band
+keys of every question at once to find candidates, then scores the
+candidates by the share of equal signature values (an estimate of the
+Jaccard similarity). Both steps are NumPy array operations over the whole
+index, with no per-question Python loop.
+"""
+
+# standard library modules
+import re
+import threading
+import zlib
+from typing import Iterable
+
+# 3rd party modules
+import numpy as np
+
+# local modules
+from core.settings import env
+
+
+_WORD = re.compile(r"\w+")
+_PRIME = np.uint64((1 << 31) - 1)
+_EMPTY = np.uint32((1 << 32) - 1)
+
+
+class QuestionIndex:
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1, capacity: int = 1024):
+        if num_perm % bands:
+            raise ValueError("`num_perm` must be a multiple of `bands`.")
+
+        rng = np.random.default_rng(seed)
+        # universal hashing (a * x + b) mod p; a, b, x < 2**31 keeps a * x in uint64
+        self._a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+        self._band_mix = rng.integers(1, 1 << 63, size=num_perm // bands, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+
+        self.size = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.signatures = np.empty((capacity, num_perm), dtype=np.uint32)
+        # band-major: one contiguous row per band scans fastest
+        self.band_keys = np.empty((bands, capacity), dtype=np.uint32)
+        self.row_of: dict[int, int] = {}
+
+        self.ready = False
+        self._removed_while_loading: set[int] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shingles(text: str) -> list[int]:
+        words = _WORD.findall(text.lower())
+        grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return [zlib.crc32(gram.encode()) & 0x7FFFFFFF for gram in set(grams)]
+
+    # Signatures -----------------------------------
+    def signatures_of(self, texts: list[str]) -> np.ndarray:
+        """MinHash signatures of many texts, (len(texts), num_perm)"""
+        per_text = [self.shingles(text) for text in texts]
+        lengths = np.fromiter((len(s) for s in per_text), dtype=np.int64, count=len(texts))
+        signatures = np.full((len(texts), self.num_perm), _EMPTY, dtype=np.uint32)
+
+        has_shingles = lengths > 0
+        if not has_shingles.any():
+            return signatures
+
+        flat = np.fromiter((h for s in per_text for h in s), dtype=np.uint64, count=int(lengths.sum()))
+        # (num_perm, all shingles), then the minimum within each text's slice
+        hashed = (self._a[:, None] * flat[None, :] + self._b[:, None]) % _PRIME
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[has_shingles]
+        signatures[has_shingles] = np.minimum.reduceat(hashed, starts, axis=1).T.astype(np.uint32)
+        return signatures
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """(len(signatures), bands) bucket keys"""
+        rows = signatures.reshape(len(signatures), self.bands, -1).astype(np.uint64)
+        # wrapping uint64 arithmetic is fine for a bucket key; the rare 32-bit
+        # collision only adds a candidate, which scoring then drops
+        return ((rows * self._band_mix).sum(axis=2) >> np.uint64(32)).astype(np.uint32)
+
+    # Updates --------------------------------------
+    def _grow(self, needed: int) -> None:
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+
+        for name in ("ids", "signatures"):
+            old = getattr(self, name)
+            new = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+        band_keys = np.empty((self.bands, capacity), dtype=np.uint32)
+        band_keys[:, :self.size] = self.band_keys[:, :self.size]
+        self.band_keys = band_keys
+
+    def add_many(self, items: Iterable[tuple[int, str]], batch_size: int = 5_000, loading: bool = False) -> None:
+        batch: list[tuple[int, str]] = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                self._add_batch(batch, loading)
+                batch = []
+        if batch:
+            self._add_batch(batch, loading)
+
+    def _add_batch(self, batch: list[tuple[int, str]], loading: bool = False) -> None:
+        signatures = self.signatures_of([text or "" for _, text in batch])
+        keys = self._band_keys(signatures)
+
+        with self._lock:
+            for (question_id, _), signature, key in zip(batch, signatures, keys):
+                # deleted since the bulk load read it
+                if loading and question_id in self._removed_while_loading:
+                    continue
+
+                row = self.row_of.get(question_id)
+                if row is None:
+                    self._grow(self.size + 1)
+                    row = self.size
+                    self.size += 1
+                    self.row_of[question_id] = row
+                self.ids[row] = question_id
+                self.signatures[row] = signature
+                self.band_keys[:, row] = key
+
+    def add(self, question_id: int, text: str) -> None:
+        self._add_batch([(question_id, text)])
+
+    def remove(self, question_id: int) -> None:
+        with self._lock:
+            if not self.ready:
+                self._removed_while_loading.add(question_id)
+
+            row = self.row_of.pop(question_id, None)
+            if row is None:
+                return
+
+            # move the last row into the gap
+            last = self.size - 1
+            if row != last:
+                moved_id = int(self.ids[last])
+                self.ids[row] = moved_id
+                self.signatures[row] = self.signatures[last]
+                self.band_keys[:, row] = self.band_keys[:, last]
+                self.row_of[moved_id] = row
+            self.size -= 1
+
+    def load(self, items: Iterable[tuple[int, str]]) -> None:
+        """Initial bulk build; live updates may run meanwhile"""
+        self.add_many(items, loading=True)
+        with self._lock:
+            self.ready = True
+            self._removed_while_loading.clear()
+
+    # Lookups --------------------------------------
+    def _top_k(
+            self,
+            signature: np.ndarray,
+            k: int,
+            min_score: float,
+            exclude: int | None
+    ) -> list[dict]:
+        # no words, no shingles: every such text has the same signature, none is similar to anything
+        if signature[0] == _EMPTY:
+            return []
+
+        keys = self._band_keys(signature[None, :])[0]
+        with self._lock:
+            n = self.size
+            # a candidate shares at least one band with the query
+            matches = self.band_keys[0, :n] == keys[0]
+            for band in range(1, self.bands):
+                matches |= self.band_keys[band, :n] == keys[band]
+            candidates = np.flatnonzero(matches)
+            if exclude is not None and exclude in self.row_of:
+                candidates = candidates[candidates != self.row_of[exclude]]
+            # a real minimum hash is below 2**31, so one column tells the empty ones apart
+            candidates = candidates[self.signatures[candidates, 0] != _EMPTY]
+            if not len(candidates):
+                return []
+
+            scores = (self.signatures[candidates] == signature).mean(axis=1)
+            ids = self.ids[candidates]
+
+        keep = scores >= min_score
+        scores, ids = scores[keep], ids[keep]
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            scores, ids = scores[best], ids[best]
+
+        order = np.argsort(-scores, kind="stable")
+        return [{"id": int(ids[i]), "score": round(float(scores[i]), 4)} for i in order]
+
+    def related(self, question_id: int, k: int = 10, min_score: float = 0.0) -> list[dict] | None:
+        """Most similar indexed questions; None if the question is not indexed"""
+        with self._lock:
+            row = self.row_of.get(question_id)
+            if row is None:
+                return None
+            signature = self.signatures[row].copy()
+        return self._top_k(signature, k, max(min_score, 1e-9), exclude=question_id)
+
+    def similar_to(self, text: str, k: int = 10, min_score: float = 0.0) -> list[dict]:
+        return self._top_k(self.signatures_of([text])[0], k, max(min_score, 1e-9), exclude=None)
+
+
+def index_from_env() -> QuestionIndex | None:
+    if not env("RELATED_INDEX", True):
+        return None
+    return QuestionIndex()
+
+
+DUPLICATE_THRESHOLD = env("DUPLICATE_THRESHOLD", 0.8)
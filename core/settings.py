@@ -0,0 +1,31 @@
+"""
+Settings read from the environment
+
+Every optional feature reads its settings through `env`, parsed as the type
+of the default. The settings are listed in the README, section
+"Configuration".
+"""
+
+# standard library modules
+import os
+from typing import TypeVar
+
+T = TypeVar("T")
+
+_TRUE = ("1", "true", "yes", "on")
+_FALSE = ("0", "false", "no", "off")
+
+
+def env(name: str, default: T) -> T:
+    """`$name` as the type of `default`; the default when unset or empty"""
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+
+    if isinstance(default, bool):
+        if raw.lower() in _TRUE:
+            return True
+        if raw.lower() in _FALSE:
+            return False
+        return default
+    return type(default)(raw)
@@ -0,0 +1 @@
+__package__ = "core.tools"
\ No newline at end of file
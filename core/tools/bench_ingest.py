@@ -0,0 +1,99 @@
+"""
+Micro-benchmark of the answer ingest path (per-request CPU)
+
+    before: JSON decode -> `Answer` model with a Python `mode="before"`
+            validator -> `model_dump()` + `question_id` -> `model_validate`
+            -> `model_dump()` -> ORM object
+    after:  cached `ANSWER_PAYLOAD.validate_json` on the raw body -> ORM object
+
+Run with
+    python -m core.tools.bench_ingest --text-size 5000
+"""
+
+# standard library modules
+import argparse
+import json
+import sys
+import timeit
+from datetime import datetime
+from numbers import Number
+from typing import Sequence
+
+# 3rd party modules
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing_extensions import Annotated, Optional
+
+# local modules
+from core.db import models
+from core.validation_models import datamodels
+
+
+class LegacyAnswer(BaseModel):
+    """`datamodels.Answer` as it was before validation moved to pydantic-core"""
+    id: int
+    question_id: Optional[int] = None
+    user_id: str
+    text: Annotated[str, Field(min_length=1)]
+    created_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True, str_strip_whitespace=True)
+
+    @field_validator("text", mode="before")
+    @classmethod
+    def validate_text(cls, value):
+        if isinstance(value, Number):
+            return str(value)
+
+        elif isinstance(value, str):
+            return value
+
+        else:
+            raise ValueError("Only strings and "
+                             "numbers are supported as answers.")
+
+
+def before(raw: bytes, question_id: int) -> models.Answer:
+    answer = LegacyAnswer.model_validate(json.loads(raw))
+    _answer = LegacyAnswer.model_validate(answer.model_dump() | {"question_id": question_id})
+    return models.Answer(**_answer.model_dump())
+
+
+def after(raw: bytes, question_id: int) -> models.Answer:
+    answer = datamodels.ANSWER_PAYLOAD.validate_json(raw)
+    answer["question_id"] = question_id
+    return models.Answer(**answer)
+
+
+def measure(func, raw: bytes, number: int, repeat: int) -> float:
+    """Best-of-`repeat` time per call, in microseconds"""
+    timings = timeit.repeat(lambda: func(raw, 1), number=number, repeat=repeat)
+    return min(timings) / number * 1e6
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m core.tools.bench_ingest")
+    parser.add_argument("--text-size", type=int, nargs="+", default=[20, 1_000, 50_000],
+                        help="answer text lengths to benchmark")
+    parser.add_argument("--number", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'text size':>10} {'before, us':>12} {'after, us':>12} {'speed-up':>9}")
+    for size in args.text_size:
+        raw = json.dumps({
+            "id": 1,
+            "user_id": "2b0c1e9e-6f1e-4a53-9b7e-1f0b6a0d1c11",
+            "text": "  " + "a" * size + "  ",
+            "created_at": None,
+        }).encode()
+
+        assert before(raw, 1).text == after(raw, 1).text
+        t_before = measure(before, raw, args.number, args.repeat)
+        t_after = measure(after, raw, args.number, args.repeat)
+        print(f"{size:>10} {t_before:>12.2f} {t_after:>12.2f} {t_before / t_after:>8.2f}x")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
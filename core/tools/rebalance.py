@@ -0,0 +1,178 @@
+"""
+Online rebalancing of question shards
+
+After appending DB URIs to `DB_SHARD_URIS`, run
+    python -m core.tools.rebalance --create-tables \
+        --shards sqlite:///s0.db sqlite:///s1.db sqlite:///s2.db
+
+to copy users to the new shards and move every question, with its answers,
+to the shard the new ring assigns it to. Each question moves on its own:
+its row is locked on the source (Postgres), copied and committed on the
+target, then deleted from the source. Reruns are safe, a question copied
+but not yet deleted is simply copied again.
+
+While it runs, the API should be started with `DB_PREVIOUS_SHARD_COUNT` set
+to the old number of shards, so questions not yet moved are still found.
+"""
+
+# standard library modules
+import argparse
+import os
+import sys
+import time
+from typing import Sequence
+
+# 3rd party modules
+from sqlalchemy import create_engine, delete, insert, select
+from sqlalchemy.orm import Session, sessionmaker
+
+# local modules
+from core.db.models import User, Question, Answer, Base
+from core.db.sharding import HashRing
+
+
+def replicate_users(source: sessionmaker, targets: Sequence[sessionmaker], batch_size: int) -> int:
+    """Insert users missing on the targets, in id order"""
+    copied = 0
+    last_id = ""
+    while True:
+        with source.begin() as session:
+            user_ids = session.execute(
+                select(User.id).where(User.id > last_id).order_by(User.id).limit(batch_size)
+            ).scalars().all()
+        if not user_ids:
+            return copied
+        last_id = user_ids[-1]
+
+        for target in targets:
+            with target.begin() as session:
+                copied += _insert_missing_users(session, set(user_ids))
+
+
+def _insert_missing_users(session: Session, user_ids: set[str]) -> int:
+    existing = set(session.execute(select(User.id).where(User.id.in_(user_ids))).scalars())
+    missing = user_ids - existing
+    if missing:
+        session.execute(insert(User), [{"id": uid} for uid in missing])
+    return len(missing)
+
+
+def move_question(source: sessionmaker, target: sessionmaker, question_id: int) -> int:
+    """Move one question and its answers; returns the number of answers moved"""
+    with source.begin() as src:
+        # blocks new answers to this question on the source until it is gone
+        question = src.execute(
+            select(Question).where(Question.id == question_id).with_for_update()
+        ).scalar_one_or_none()
+        if question is None:
+            return 0
+
+        answers = src.execute(select(Answer).where(Answer.question_id == question_id)).scalars().all()
+
+        with target.begin() as dst:
+            _insert_missing_users(dst, {answer.user_id for answer in answers})
+            # leftovers of an interrupted run are replaced
+            dst.execute(delete(Answer).where(Answer.question_id == question_id))
+            dst.execute(delete(Question).where(Question.id == question_id))
+            dst.execute(insert(Question), [{
+                "id": question.id, "text": question.text, "created_at": question.created_at}])
+            if answers:
+                dst.execute(insert(Answer), [{
+                    "id": a.id, "question_id": a.question_id, "user_id": a.user_id,
+                    "text": a.text, "created_at": a.created_at} for a in answers])
+
+        src.execute(delete(Answer).where(Answer.question_id == question_id))
+        src.execute(delete(Question).where(Question.id == question_id))
+
+    return len(answers)
+
+
+def rebalance(
+        db_uri: str,
+        shard_uris: Sequence[str],
+        batch_size: int = 500,
+        create_tables: bool = False,
+        dry_run: bool = False
+) -> dict[str, int]:
+    engines = {uri: create_engine(uri) for uri in dict.fromkeys([db_uri, *shard_uris])}
+    makers = {uri: sessionmaker(bind=engine, expire_on_commit=False) for uri, engine in engines.items()}
+    shards = [makers[uri] for uri in shard_uris]
+    ring = HashRing(len(shards))
+    stats = {"users": 0, "questions": 0, "answers": 0}
+
+    try:
+        if create_tables:
+            for engine in engines.values():
+                Base.metadata.create_all(engine)
+
+        if not dry_run:
+            replicas = [maker for uri, maker in makers.items() if uri != db_uri]
+            stats["users"] = replicate_users(makers[db_uri], replicas, batch_size)
+
+        for index, shard in enumerate(shards):
+            last_id = 0
+            while True:
+                with shard.begin() as session:
+                    question_ids = session.execute(
+                        select(Question.id).where(Question.id > last_id)
+                        .order_by(Question.id).limit(batch_size)
+                    ).scalars().all()
+                if not question_ids:
+                    break
+                last_id = question_ids[-1]
+
+                for question_id in question_ids:
+                    owner = ring.shard_for(question_id)
+                    if owner == index:
+                        continue
+
+                    stats["questions"] += 1
+                    if not dry_run:
+                        stats["answers"] += move_question(shard, shards[owner], question_id)
+
+            print(f"[INFO]\tshard {index}: scanned, {stats['questions']} questions moved so far")
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+
+    return stats
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m core.tools.rebalance",
+        description="Move questions and answers to their shard on the current ring."
+    )
+    parser.add_argument("--db-uri", default=os.getenv("DB_URI"),
+                        help="global DB holding all users (default: $DB_URI)")
+    parser.add_argument("--shards", nargs="+",
+                        default=os.getenv("DB_SHARD_URIS", "").split(),
+                        help="all shard URIs, new ones last (default: $DB_SHARD_URIS)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--create-tables", action="store_true",
+                        help="create missing tables on every DB first")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only count the questions that would move")
+    args = parser.parse_args(argv)
+
+    if args.db_uri is None:
+        print("[ERROR]\tDB_URI not set.")
+        return 1
+    if not args.shards:
+        print("[ERROR]\tNo shards given.")
+        return 1
+
+    started = time.perf_counter()
+    try:
+        stats = rebalance(args.db_uri, args.shards, args.batch_size, args.create_tables, args.dry_run)
+    except Exception as e:
+        print(f"[ERROR]\t{e}")
+        return 1
+
+    print(f"[INFO]\t{stats['users']} users copied, {stats['questions']} questions and "
+          f"{stats['answers']} answers moved in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
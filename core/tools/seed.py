@@ -0,0 +1,322 @@
+"""
+Synthetic data generator for scale testing
+
+Fills `User`, `Question` and `Answer` tables (see `core/db/models.py`) with
+deterministic, production-shaped data: a few questions collect most of
+the answers, a few users write most of them, and `created_at` values are
+spread over a configurable time window.
+
+Run with
+    python -m core.tools.seed --db-uri sqlite:///scale.db --create-tables \
+        --users 10000 --questions 200000 --answers 2000000 --seed 42
+
+Postgres targets are loaded with COPY, any other backend with batched
+multi-row inserts. Run again on the same database, question and answer ids
+continue after the existing ones, and users that already exist are kept.
+"""
+
+# standard library modules
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+import uuid
+from typing import Iterable, Iterator, Sequence
+
+# 3rd party modules
+from sqlalchemy import Connection, Table, create_engine, func, insert, select, text
+
+# local modules
+from core.db.models import User, Question, Answer, Base
+
+
+# vocabulary the generated texts are sampled from
+WORDS: tuple[str, ...] = (
+    "api", "async", "backup", "benchmark", "buffer", "cache", "client", "cluster",
+    "column", "commit", "config", "connection", "container", "cursor", "data",
+    "database", "deadlock", "deploy", "docker", "endpoint", "error", "event",
+    "fastapi", "field", "function", "handler", "header", "index", "insert",
+    "json", "join", "key", "latency", "lock", "log", "memory", "migration",
+    "model", "network", "null", "object", "orm", "page", "parser", "pool",
+    "postgres", "process", "proxy", "python", "query", "queue", "request",
+    "response", "retry", "router", "schema", "server", "session", "shard",
+    "socket", "sql", "sqlite", "stream", "string", "table", "test", "thread",
+    "timeout", "token", "transaction", "type", "update", "user", "validation",
+    "value", "worker", "why", "how", "when", "does", "should", "can", "the",
+    "a", "my", "with", "without", "after", "before", "slow", "fast", "fails",
+)
+
+DEFAULT_START = datetime.datetime(2023, 1, 1)
+
+
+# Generators -------------------------------------
+def zipf_cum_weights(n: int, skew: float) -> list[float]:
+    """Cumulative Zipf weights for ranks 1..n, for `random.Random.choices`"""
+    return list(itertools.accumulate(1.0 / (rank ** skew) for rank in range(1, n + 1)))
+
+
+def sentence(rng: random.Random, min_words: int, max_words: int) -> str:
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return " ".join(words).capitalize()
+
+
+def generate_users(rng: random.Random, n_users: int) -> list[str]:
+    # UUIDs from the seeded generator, so ids are stable across runs
+    return [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(n_users)]
+
+
+def generate_question_times(
+        rng: random.Random,
+        n_questions: int,
+        start: datetime.datetime,
+        end: datetime.datetime
+) -> list[datetime.datetime]:
+    # one jittered slot per question: ids grow together with `created_at`
+    span = (end - start) / n_questions
+    return [start + span * (i + rng.random()) for i in range(n_questions)]
+
+
+def generate_questions(
+        rng: random.Random,
+        question_times: Sequence[datetime.datetime],
+        question_id_offset: int
+) -> Iterator[tuple]:
+    for i, created_at in enumerate(question_times):
+        yield question_id_offset + i + 1, sentence(rng, 4, 12) + "?", created_at
+
+
+def generate_answers(
+        rng: random.Random,
+        n_answers: int,
+        question_times: Sequence[datetime.datetime],
+        user_ids: Sequence[str],
+        skew: float,
+        end: datetime.datetime,
+        question_id_offset: int,
+        answer_id_offset: int,
+        batch_size: int
+) -> Iterator[tuple]:
+    # popularity ranks are shuffled, so hot questions are spread over time
+    question_ranks = list(range(len(question_times)))
+    rng.shuffle(question_ranks)
+    question_weights = zipf_cum_weights(len(question_ranks), skew)
+
+    user_ranks = list(range(len(user_ids)))
+    rng.shuffle(user_ranks)
+    user_weights = zipf_cum_weights(len(user_ranks), skew)
+
+    answer_id = answer_id_offset
+    left = n_answers
+    while left > 0:
+        k = min(batch_size, left)
+        picked_questions = rng.choices(question_ranks, cum_weights=question_weights, k=k)
+        picked_users = rng.choices(user_ranks, cum_weights=user_weights, k=k)
+
+        for q_idx, u_idx in zip(picked_questions, picked_users):
+            answer_id += 1
+            asked_at = question_times[q_idx]
+            # most answers arrive shortly after the question, with a long tail
+            delay = datetime.timedelta(hours=rng.expovariate(1 / 12))
+            yield (
+                answer_id,
+                question_id_offset + q_idx + 1,
+                user_ids[u_idx],
+                sentence(rng, 3, 30),
+                min(asked_at + delay, end),
+            )
+        left -= k
+
+
+# Writers ----------------------------------------
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def copy_rows(conn: Connection, table: Table, rows: Iterable[tuple]) -> int:
+    """Stream rows through Postgres `COPY ... FROM STDIN` (psycopg 3)"""
+    columns = ", ".join(f'"{c.name}"' for c in table.columns)
+    count = 0
+    driver_conn = conn.connection.driver_connection
+    with driver_conn.cursor() as cursor:
+        with cursor.copy(f'COPY "{table.name}" ({columns}) FROM STDIN') as copy:
+            for row in rows:
+                copy.write_row(row)
+                count += 1
+    return count
+
+
+def insert_rows(conn: Connection, table: Table, rows: Iterable[tuple], batch_size: int) -> int:
+    """Multi-row inserts, one `executemany` per batch"""
+    names = [c.name for c in table.columns]
+    stmt = insert(table)
+    count = 0
+    for batch in batched(rows, batch_size):
+        conn.execute(stmt, [dict(zip(names, row)) for row in batch])
+        count += len(batch)
+    return count
+
+
+def max_id(conn: Connection, table: Table) -> int:
+    return conn.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar_one()
+
+
+def existing_users(conn: Connection, user_ids: Sequence[str], batch_size: int) -> set[str]:
+    """Ids in `user_ids` already in the `User` table, e.g. from a run with the same seed"""
+    table = User.__table__
+    existing: set[str] = set()
+    # bounded IN lists, SQLite allows 32766 parameters at most
+    for batch in batched(user_ids, min(batch_size, 10_000)):
+        existing.update(conn.execute(select(table.c.id).where(table.c.id.in_(batch))).scalars())
+    return existing
+
+
+def reset_sequences(conn: Connection) -> None:
+    # explicit ids bypass Postgres serials, so move them past the seeded rows
+    for table in (Question.__table__, Answer.__table__):
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"
+        ))
+
+
+def seed(
+        db_uri: str,
+        users: int,
+        questions: int,
+        answers: int,
+        seed_value: int = 0,
+        skew: float = 1.1,
+        start: datetime.datetime = DEFAULT_START,
+        days: int = 365,
+        question_id_offset: int | None = None,
+        answer_id_offset: int | None = None,
+        batch_size: int = 10_000,
+        method: str = "auto",
+        create_tables: bool = False
+) -> dict[str, int]:
+    """
+    Write a synthetic dataset to `db_uri`; returns rows written per table
+
+    Ids start after the largest id in each table, unless an offset is given.
+    """
+    if users < 1 or questions < 1:
+        raise ValueError("At least one user and one question are needed.")
+
+    engine = create_engine(db_uri)
+    is_postgres = engine.dialect.name == "postgresql"
+    if method == "auto":
+        method = "copy" if is_postgres else "insert"
+    if method == "copy" and not is_postgres:
+        raise ValueError("COPY is only supported on Postgres.")
+
+    if create_tables:
+        Base.metadata.create_all(engine)
+
+    rng = random.Random(seed_value)
+    end = start + datetime.timedelta(days=days)
+
+    user_ids = generate_users(rng, users)
+    question_times = generate_question_times(rng, questions, start, end)
+
+    written: dict[str, int] = {}
+    try:
+        with engine.begin() as conn:
+            if engine.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA synchronous = OFF")
+
+            if question_id_offset is None:
+                question_id_offset = max_id(conn, Question.__table__)
+            if answer_id_offset is None:
+                answer_id_offset = max_id(conn, Answer.__table__)
+            existing = existing_users(conn, user_ids, batch_size)
+            if existing:
+                print(f"[INFO]\t{User.__tablename__}: {len(existing)} users already exist, skipped")
+
+            plan = (
+                (User.__table__, ((uid,) for uid in user_ids if uid not in existing)),
+                (Question.__table__, generate_questions(rng, question_times, question_id_offset)),
+                (Answer.__table__, generate_answers(
+                    rng, answers, question_times, user_ids, skew, end,
+                    question_id_offset, answer_id_offset, batch_size)),
+            )
+            for table, rows in plan:
+                started = time.perf_counter()
+                if method == "copy":
+                    written[table.name] = copy_rows(conn, table, rows)
+                else:
+                    written[table.name] = insert_rows(conn, table, rows, batch_size)
+
+                elapsed = time.perf_counter() - started
+                print(f"[INFO]\t{table.name}: {written[table.name]} rows in {elapsed:.1f}s "
+                      f"({written[table.name] / max(elapsed, 1e-9):,.0f} rows/s)")
+
+            if is_postgres:
+                reset_sequences(conn)
+    finally:
+        engine.dispose()
+
+    return written
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m core.tools.seed",
+        description="Generate deterministic synthetic users, questions and answers."
+    )
+    parser.add_argument("--db-uri", default=os.getenv("DB_URI"),
+                        help="target database (default: $DB_URI)")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--questions", type=int, default=10_000)
+    parser.add_argument("--answers", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0,
+                        help="same seed, same data")
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="Zipf exponent for answers per question and per user")
+    parser.add_argument("--start", type=datetime.datetime.fromisoformat, default=DEFAULT_START,
+                        help="earliest `created_at` (ISO format)")
+    parser.add_argument("--days", type=int, default=365,
+                        help="length of the `created_at` window")
+    parser.add_argument("--question-id-offset", type=int, default=None,
+                        help="first question id minus one (default: largest existing id)")
+    parser.add_argument("--answer-id-offset", type=int, default=None,
+                        help="first answer id minus one (default: largest existing id)")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--method", choices=("auto", "copy", "insert"), default="auto")
+    parser.add_argument("--create-tables", action="store_true",
+                        help="create missing tables before loading")
+    args = parser.parse_args(argv)
+
+    if args.db_uri is None:
+        print("[ERROR]\tDB_URI not set.")
+        return 1
+
+    try:
+        seed(
+            db_uri=args.db_uri,
+            users=args.users,
+            questions=args.questions,
+            answers=args.answers,
+            seed_value=args.seed,
+            skew=args.skew,
+            start=args.start,
+            days=args.days,
+            question_id_offset=args.question_id_offset,
+            answer_id_offset=args.answer_id_offset,
+            batch_size=args.batch_size,
+            method=args.method,
+            create_tables=args.create_tables,
+        )
+    except Exception as e:
+        print(f"[ERROR]\t{e}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
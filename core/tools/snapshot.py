@@ -0,0 +1,122 @@
+"""
+Snapshot of the hottest questions for start up warm-up
+
+Run before a deploy or restart, e.g.
+    python -m core.tools.snapshot --out /data/snapshot.qas --questions 20000
+
+then start the API with `SNAPSHOT_PATH=/data/snapshot.qas`. "Hot" means the
+most answered. Every shard in `DB_SHARD_URIS` is read. The file is replaced
+atomically, so it can be refreshed while workers serve the previous one.
+See `core.db.snapshot` for the layout.
+"""
+
+# standard library modules
+import argparse
+import datetime
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Sequence
+
+# 3rd party modules
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+
+# local modules
+from core.db.models import Question, Answer
+from core.db.snapshot import write_snapshot
+
+
+def take_snapshot(
+        db_uri: str,
+        path: str,
+        n_questions: int = 10_000,
+        shard_uris: Sequence[str] | None = None,
+        batch_size: int = 1_000
+) -> dict[str, int]:
+    uris = list(dict.fromkeys(shard_uris or [db_uri]))
+    engines = [create_engine(uri) for uri in uris]
+    shards = [sessionmaker(bind=engine, expire_on_commit=False) for engine in engines]
+    # anything committed after this is left to the readers' reconciliation
+    taken_at = datetime.datetime.now(datetime.UTC).replace(tzinfo=None)
+
+    try:
+        max_answer_id = 0
+        for shard in shards:
+            with shard.begin() as session:
+                max_answer_id = max(max_answer_id, session.execute(select(func.max(Answer.id))).scalar() or 0)
+
+        answer_counts: Counter[int] = Counter()
+        for shard in shards:
+            with shard.begin() as session:
+                answer_counts.update(dict(session.execute(
+                    select(Answer.question_id, func.count(Answer.id))
+                    .group_by(Answer.question_id)
+                    .order_by(func.count(Answer.id).desc())
+                    .limit(n_questions)
+                ).all()))
+        hot_ids = sorted(question_id for question_id, _ in answer_counts.most_common(n_questions))
+
+        questions: dict[int, Question] = {}
+        answers: defaultdict[int, dict[int, Answer]] = defaultdict(dict)
+        for start in range(0, len(hot_ids), batch_size):
+            ids = hot_ids[start:start + batch_size]
+            for shard in shards:
+                with shard.begin() as session:
+                    for question in session.execute(select(Question).where(Question.id.in_(ids))).scalars():
+                        questions[question.id] = question
+                    for answer in session.execute(select(Answer).where(Answer.question_id.in_(ids))).scalars():
+                        # a question copied but not yet deleted by a rebalance appears twice
+                        answers[answer.question_id][answer.id] = answer
+    finally:
+        for engine in engines:
+            engine.dispose()
+
+    return write_snapshot(
+        path,
+        list(questions.values()),
+        {question_id: list(by_id.values()) for question_id, by_id in answers.items()},
+        taken_at=taken_at,
+        max_answer_id=max_answer_id,
+    )
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m core.tools.snapshot",
+        description="Write the most answered questions and their answers to a snapshot file."
+    )
+    parser.add_argument("--db-uri", default=os.getenv("DB_URI"),
+                        help="database to read (default: $DB_URI)")
+    parser.add_argument("--shards", nargs="+",
+                        default=os.getenv("DB_SHARD_URIS", "").split(),
+                        help="question shards (default: $DB_SHARD_URIS)")
+    parser.add_argument("--out", default=os.getenv("SNAPSHOT_PATH"),
+                        help="snapshot file (default: $SNAPSHOT_PATH)")
+    parser.add_argument("--questions", type=int, default=10_000,
+                        help="number of questions to keep, most answered first")
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args(argv)
+
+    if args.db_uri is None:
+        print("[ERROR]\tDB_URI not set.")
+        return 1
+    if args.out is None:
+        print("[ERROR]\tNo output file given.")
+        return 1
+
+    started = time.perf_counter()
+    try:
+        stats = take_snapshot(args.db_uri, args.out, args.questions, args.shards, args.batch_size)
+    except Exception as e:
+        print(f"[ERROR]\t{e}")
+        return 1
+
+    print(f"[INFO]\t{stats['questions']} questions and {stats['answers']} answers "
+          f"written to {args.out} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
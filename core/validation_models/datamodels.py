@@ -1,14 +1,28 @@
 # default library modules
 from datetime import datetime
-from numbers import Number
 
 # 3rd party modules
-from pydantic import BaseModel, ConfigDict, Field, field_validator
-from typing_extensions import Annotated, Optional
+from pydantic import BaseModel, BeforeValidator, ConfigDict, Field, StrictStr, TypeAdapter
+from typing_extensions import Annotated, NotRequired, Optional, TypedDict
+
+
+# Field types — constraints are enforced by pydantic-core, no Python validators
+UserId = Annotated[str, Field(min_length=1, max_length=36)]
+
+# at least two characters — 1 alphanumeric symbol + 1 question mark; strings only
+QuestionText = Annotated[StrictStr, Field(min_length=2)]
+
+# at least one character; numbers and booleans are accepted and stored as strings
+# (`true` -> "True"), as `bool` is a `Number` for the former Python validator
+AnswerText = Annotated[
+    str,
+    Field(min_length=1, coerce_numbers_to_str=True),
+    BeforeValidator(lambda value: str(value) if isinstance(value, bool) else value),
+]
 
 
 class User(BaseModel):
-    id: Annotated[str, Field(min_length=1, max_length=36)]
+    id: UserId
 
     # ORM-related, also strip whitespace from left and right
     model_config = ConfigDict(from_attributes=True, str_strip_whitespace=True)
@@ -17,45 +31,55 @@ class User(BaseModel):
 class Question(BaseModel):
     # model fields
     id: int
-    text: Annotated[
-        str, Field(min_length=2)]  # at least two characters — 1 alphanumeric symbol + 1 question mark
+    text: QuestionText
     created_at: Optional[datetime] = None
 
     # ORM related, also strip whitespace from left and right
     model_config = ConfigDict(from_attributes=True, str_strip_whitespace=True)
 
-    # field validators
-    @field_validator("text", mode="before")
-    @classmethod
-    def validate_text(cls, value):
-        if isinstance(value, str):
-            return value
-
-        else:
-            raise ValueError("Only strings are supported as questions.")
-
 
 class Answer(BaseModel):
     # model fields
     id: int
     question_id: Optional[int] = None
     user_id: str
-    text: Annotated[str, Field(min_length=1)]  # at least one alphanumeric character (see `validate_text`)
+    text: AnswerText
     created_at: Optional[datetime] = None
 
     # ORM-related, also strip whitespace from left and right
     model_config = ConfigDict(from_attributes=True, str_strip_whitespace=True)
 
-    # field validators
-    @field_validator("text", mode="before")
-    @classmethod
-    def validate_text(cls, value):
-        if isinstance(value, Number):
-            return str(value)
 
-        elif isinstance(value, str):
-            return value
+# Request payloads --------------------------------
+# Plain dicts validated straight from JSON bytes by cached adapters: one
+# validation per request, and the result is usable as ORM constructor kwargs.
+_PAYLOAD_CONFIG = ConfigDict(str_strip_whitespace=True)
+
+
+class UserPayload(TypedDict):
+    __pydantic_config__ = _PAYLOAD_CONFIG
+
+    id: UserId
+
+
+class QuestionPayload(TypedDict):
+    __pydantic_config__ = _PAYLOAD_CONFIG
+
+    id: int
+    text: QuestionText
+    created_at: NotRequired[Optional[datetime]]
+
+
+class AnswerPayload(TypedDict):
+    __pydantic_config__ = _PAYLOAD_CONFIG
+
+    id: int
+    question_id: NotRequired[Optional[int]]  # the path parameter wins
+    user_id: str
+    text: AnswerText
+    created_at: NotRequired[Optional[datetime]]
+
 
-        else:
-            raise ValueError("Only strings and "
-                             "numbers are supported as answers.")
+USER_PAYLOAD = TypeAdapter(UserPayload)
+QUESTION_PAYLOAD = TypeAdapter(QuestionPayload)
+ANSWER_PAYLOAD = TypeAdapter(AnswerPayload)
@@ -0,0 +1,138 @@
+# standard library modules
+import asyncio
+import json
+
+# 3rd party modules
+import pytest
+
+# local modules
+from core.main.broker import AnswerBroker, BrokerFull, PostgresNotifyBridge
+
+
+def answer(answer_id: int, question_id: int = 1) -> dict:
+    return {"id": answer_id, "question_id": question_id, "user_id": "root", "text": f"Answer {answer_id}"}
+
+
+async def read_frames(events, n: int) -> list[str]:
+    return [await anext(events) for _ in range(n)]
+
+
+class TestAnswerBroker:
+    @pytest.fixture
+    def broker(self) -> AnswerBroker:
+        return AnswerBroker(queue_size=2, max_subscribers=3, keepalive=0.01)
+
+    def test_fan_out(self, broker: AnswerBroker):
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        assert broker.publish(1, answer(10)) == 2, "Not delivered to every subscriber of the question"
+        assert other.queue.empty(), "Delivered to another question's subscriber"
+        frame = first.queue.get_nowait()
+        assert frame == second.queue.get_nowait(), "Subscribers got different frames"
+        assert json.loads(frame.split("data: ")[1]) == answer(10), "Answer changed on the way"
+
+    def test_slow_consumer_evicted(self, broker: AnswerBroker):
+        slow, fast = broker.subscribe(1), broker.subscribe(1)
+        for answer_id in (10, 11):
+            broker.publish(1, answer(answer_id))
+        fast.queue.get_nowait()
+        assert broker.publish(1, answer(12)) == 1, "Full queue held up the publisher"
+        assert slow.evicted and broker.evictions == 1, "Slow consumer not evicted"
+        assert slow.queue.get_nowait() is None, "Evicted subscriber not sent the end marker"
+        assert broker.count == 1 and broker.has_subscribers(1), "Evicted subscriber still counted"
+
+    def test_max_subscribers(self, broker: AnswerBroker):
+        subscriptions = [broker.subscribe(question_id) for question_id in (1, 2, 3)]
+        assert broker.full, "Broker at `max_subscribers` not full"
+        with pytest.raises(BrokerFull):
+            broker.subscribe(4)
+        broker.unsubscribe(subscriptions[0])
+        assert not broker.full and broker.subscribe(4), "Slot not freed by unsubscribe"
+
+    def test_events_subscribe_when_streaming(self, broker: AnswerBroker):
+        async def stream():
+            events = broker.events(1)
+            assert broker.count == 0, "Subscribed before the stream started"
+            assert await read_frames(events, 1) == ["retry: 3000\n\n"], "No reconnect delay sent first"
+            assert broker.count == 1, "Not subscribed once streaming"
+
+            broker.publish(1, answer(10))
+            frame, keepalive = await read_frames(events, 2)
+            assert frame.startswith("id: 10\nevent: answer\n"), "Answer not streamed"
+            assert keepalive == ": keep-alive\n\n", "No keep-alive while idle"
+
+            # the client disconnects
+            await events.aclose()
+            assert broker.count == 0 and not broker.has_subscribers(1), "Disconnected client kept its slot"
+
+        asyncio.run(stream())
+
+    def test_events_when_full(self, broker: AnswerBroker):
+        for question_id in (1, 2, 3):
+            broker.subscribe(question_id)
+
+        async def stream():
+            return [frame async for frame in broker.events(4)]
+
+        assert asyncio.run(stream()) == ["event: full\ndata: {}\n\n"], "Stream opened past `max_subscribers`"
+
+
+class TestPostgresNotifyBridge:
+    @pytest.fixture
+    def stalled_bridge(self, monkeypatch) -> PostgresNotifyBridge:
+        bridge = PostgresNotifyBridge(AnswerBroker(), "postgresql://localhost/db", fetch_answer=None, timeout=0.05)
+
+        async def stalled_connection():
+            # e.g. Postgres stopped answering mid-connect
+            await asyncio.sleep(60)
+
+        monkeypatch.setattr(bridge, "_connection", stalled_connection)
+        return bridge
+
+    def test_stalled_notify_falls_back_to_local(self, stalled_bridge: PostgresNotifyBridge):
+        async def publish():
+            subscription = stalled_bridge.broker.subscribe(1)
+            await asyncio.wait_for(stalled_bridge.publish(1, answer(10)), 1.0)
+            return subscription.queue.get_nowait()
+
+        assert asyncio.run(publish()).startswith("id: 10\n"), "Local subscriber lost the answer"
+
+    def test_publish_soon_does_not_wait(self, stalled_bridge: PostgresNotifyBridge):
+        async def publish():
+            subscription = stalled_bridge.broker.subscribe(1)
+            stalled_bridge.publish_soon(1, answer(10))
+            assert subscription.queue.empty() and stalled_bridge._pending, "Caller waited for the NOTIFY"
+            await stalled_bridge.stop()
+            return subscription.queue.get_nowait()
+
+        assert asyncio.run(publish()).startswith("id: 10\n"), "Pending answer dropped at shutdown"
+
+    def test_publish_reconnects(self, monkeypatch):
+        psycopg = pytest.importorskip("psycopg")
+
+        class FakeConnection:
+            def __init__(self, alive: bool):
+                self.alive = alive
+                self.closed = False
+                self.notified = []
+
+            async def execute(self, query, params):
+                if not self.alive:
+                    raise psycopg.OperationalError("server closed the connection")
+                self.notified.append(params)
+
+            async def close(self):
+                self.closed = True
+
+        connections = [FakeConnection(alive=False), FakeConnection(alive=True)]
+
+        async def connect(*args, **kwargs):
+            return connections.pop(0)
+
+        monkeypatch.setattr(psycopg.AsyncConnection, "connect", connect)
+        broker = AnswerBroker()
+        bridge = PostgresNotifyBridge(broker, "postgresql://localhost/db", fetch_answer=None)
+        lost, fresh = connections
+
+        asyncio.run(bridge.publish(1, answer(10)))
+        assert lost.closed and bridge._notify_conn is fresh, "Lost NOTIFY connection not replaced"
+        assert fresh.notified == [(bridge.CHANNEL, json.dumps(answer(10)))], "Answer not sent on the new connection"
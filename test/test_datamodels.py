@@ -0,0 +1,54 @@
+# standard library modules
+import asyncio
+import json
+
+# 3rd party modules
+import pytest
+from fastapi.exceptions import RequestValidationError
+
+# local modules
+from core.main.endpoints import _validate_body
+from core.validation_models import datamodels
+
+
+class FakeRequest:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+def validate(payload, adapter=datamodels.ANSWER_PAYLOAD) -> dict:
+    return asyncio.run(_validate_body(FakeRequest(json.dumps(payload).encode()), adapter))
+
+
+class TestPayloads:
+    @pytest.mark.parametrize("text, stored", [("  Yes ", "Yes"), (42, "42"), (1.5, "1.5"), (True, "True")])
+    def test_answer_text_coerced(self, text, stored):
+        answer = validate({"id": 1, "user_id": "root", "text": text})
+        assert answer["text"] == stored, "Answer text not stored as the former validator did"
+
+    @pytest.mark.parametrize("text", ["", "   ", None, ["Yes"]])
+    def test_answer_text_rejected(self, text):
+        with pytest.raises(RequestValidationError):
+            validate({"id": 1, "user_id": "root", "text": text})
+
+    def test_question_text_strings_only(self):
+        with pytest.raises(RequestValidationError):
+            validate({"id": 1, "text": 42}, datamodels.QUESTION_PAYLOAD)
+
+    def test_error_shape(self):
+        with pytest.raises(RequestValidationError) as exc_info:
+            validate({"id": "one", "user_id": "root"})
+
+        errors = {error["loc"]: error for error in exc_info.value.errors()}
+        assert set(errors) == {("body", "id"), ("body", "text")}, "Errors not located in the body"
+        assert errors[("body", "text")]["type"] == "missing", "Missing field not reported as such"
+        assert all({"type", "msg", "input"} <= set(error) and "url" not in error for error in errors.values()), \
+            "Not FastAPI's 422 error shape"
+
+    def test_invalid_json(self):
+        with pytest.raises(RequestValidationError) as exc_info:
+            asyncio.run(_validate_body(FakeRequest(b'{"id": '), datamodels.USER_PAYLOAD))
+        assert exc_info.value.errors()[0]["loc"][0] == "body", "Invalid JSON not located in the body"
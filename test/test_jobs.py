@@ -0,0 +1,102 @@
+# standard library modules
+import asyncio
+from pathlib import Path
+
+# 3rd party modules
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+# local modules
+from core.db import models
+from core.db.queries import QueriesApp
+from core.db.resilience import TransientDatabaseError
+from core.main.jobs import Job, JobRegistry, delete_in_batches
+
+
+async def run_job(registry: JobRegistry, run) -> Job:
+    await registry.start()
+    job = registry.submit("test", 1, run)
+    while job.finished_at is None:
+        await asyncio.sleep(0.01)
+    await registry.stop()
+    return job
+
+
+class TestJobs:
+    @pytest.fixture
+    def registry(self) -> JobRegistry:
+        return JobRegistry(max_retries=2, retry_backoff=0.01)
+
+    def test_transient_errors_retried(self, registry: JobRegistry):
+        attempts = []
+
+        def run(job: Job) -> None:
+            attempts.append(job.id)
+            if len(attempts) < 3:
+                raise TransientDatabaseError("server closed the connection")
+
+        job = asyncio.run(run_job(registry, run))
+        assert job.status == Job.DONE and len(attempts) == 3, "Transient error not retried"
+
+    def test_retries_bounded(self, registry: JobRegistry):
+        def run(job: Job) -> None:
+            raise TransientDatabaseError("server closed the connection")
+
+        job = asyncio.run(run_job(registry, run))
+        assert job.status == Job.FAILED and job.error, "Job retried forever"
+
+    def test_other_errors_fail_at_once(self, registry: JobRegistry):
+        attempts = []
+
+        def run(job: Job) -> None:
+            attempts.append(job.id)
+            raise ValueError("bad job")
+
+        job = asyncio.run(run_job(registry, run))
+        assert job.status == Job.FAILED and len(attempts) == 1, "Non-transient error retried"
+
+    def test_batch_delete_raises_operational_errors(self, tmp_path: Path):
+        client = QueriesApp(db_uri=f"sqlite:///{tmp_path / 'jobs.db'}")
+        models.Base.metadata.create_all(client.engine)
+        assert client.delete_answers_batch(10, question_id=1) == 0, "Nothing to delete, yet deleted"
+
+        with client.engine.begin() as conn:
+            conn.execute(text('DROP TABLE "Answer"'))
+        with pytest.raises(TransientDatabaseError):
+            client.delete_answers_batch(10, question_id=1)
+        with pytest.raises(TransientDatabaseError):
+            client.count_answers(user_id="root")
+        client.close()
+
+    def test_parent_delete_retried(self, registry: JobRegistry, tmp_path: Path):
+        client = QueriesApp(db_uri=f"sqlite:///{tmp_path / 'jobs.db'}")
+        models.Base.metadata.create_all(client.engine)
+        assert client.create_user(models.User(id="root")), "User not created"
+        assert client.create_question(models.Question(id=1, text="First question?")), "Question not created"
+        for answer_id in range(1, 4):
+            assert client.create_answer(models.Answer(id=answer_id, question_id=1, user_id="root", text="Yes")), \
+                "Answer not created"
+
+        # the connection is lost once, right at the last step
+        lost = []
+
+        def lose_connection(conn, cursor, statement, *args):
+            if statement.startswith('DELETE FROM "Question"') and not lost:
+                lost.append(statement)
+                raise OperationalError(statement, None, Exception("server closed the connection"))
+
+        event.listen(client.engine, "before_cursor_execute", lose_connection)
+
+        def run(job: Job) -> None:
+            delete_in_batches(job, client, lambda: client.delete_question(1), batch_size=2, question_id=1)
+
+        job = asyncio.run(run_job(registry, run))
+        assert job.status == Job.DONE and job.done == 3 and lost, "Parent delete not retried"
+        assert client.get_question(1) is None, "Question not deleted"
+
+        # a second job for the same target: nothing left, still done
+        job = asyncio.run(run_job(registry, run))
+        assert job.status == Job.DONE and job.done == 0, "Deleting again failed"
+        assert client.delete_user("ghost"), "Deleting a missing user failed"
+        client.close()
@@ -0,0 +1,130 @@
+# standard library modules
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 3rd party modules
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import Engine, create_engine
+from starlette.requests import Request
+
+# local modules
+from core.db import models
+from core.db.queries import QueriesApp
+from core.main.profiling import QueryProfiler, RequestProfile, _current_profile, statement_shape
+
+
+class TestStatementShape:
+    @pytest.mark.parametrize("statement, shape", [
+        ('SELECT * FROM "Answer" WHERE id = ?', 'SELECT * FROM "Answer" WHERE id = ?'),
+        ('SELECT * FROM "Answer" WHERE id = %(id_1)s', 'SELECT * FROM "Answer" WHERE id = ?'),
+        ('SELECT * FROM "Answer" WHERE id = :id', 'SELECT * FROM "Answer" WHERE id = ?'),
+        ('SELECT * FROM "Answer" WHERE id = $1 LIMIT 10', 'SELECT * FROM "Answer" WHERE id = ? LIMIT ?'),
+        ('SELECT * FROM "Answer" WHERE id IN (?, ?, ?)', 'SELECT * FROM "Answer" WHERE id IN (?...)'),
+        ('SELECT * FROM "Answer" WHERE id IN (%s,%s)', 'SELECT * FROM "Answer" WHERE id IN (?...)'),
+        ('SELECT *\n  FROM "Answer"\n  WHERE id = 42', 'SELECT * FROM "Answer" WHERE id = ?'),
+    ])
+    def test_shape(self, statement: str, shape: str):
+        assert statement_shape(statement) == shape, "Statement shape changed"
+
+    def test_in_lists_of_any_length_match(self):
+        assert statement_shape("SELECT 1 WHERE id IN (?, ?)") == statement_shape("SELECT 1 WHERE id IN (?, ?, ?, ?)"), \
+            "IN-lists of different lengths got different shapes"
+
+    def test_names_kept(self):
+        assert statement_shape('SELECT "Answer".id_2 FROM t2') == 'SELECT "Answer".id_2 FROM t2', \
+            "Digits inside identifiers replaced"
+
+
+class TestFlags:
+    @pytest.fixture
+    def profiler(self) -> QueryProfiler:
+        return QueryProfiler(max_statements=3, max_transactions=1, repeat_threshold=2, slow_ms=100.0)
+
+    @pytest.fixture
+    def engine(self) -> Engine:
+        engine = create_engine("sqlite://")
+        yield engine
+        engine.dispose()
+
+    def test_one_transaction_per_shard(self, profiler: QueryProfiler):
+        profile = RequestProfile("GET", "/questions")
+        shards = [create_engine("sqlite://") for _ in range(3)]
+        for shard in shards:
+            profile.add_transaction(shard)
+        profiler.flag(profile)
+        assert profile.transactions == 3 and profile.flags == [], "Sharded fan-out flagged"
+
+    def test_quiet_request(self, profiler: QueryProfiler, engine: Engine):
+        profile = RequestProfile("GET", "/questions/1")
+        profile.add_transaction(engine)
+        for statement in ("SELECT 1 FROM a WHERE id = 1", "SELECT 1 FROM b WHERE id = 1"):
+            profile.add_statement(statement, 0.001)
+        profiler.flag(profile)
+        assert profile.flags == [], "Quiet request flagged"
+
+    def test_every_rule(self, profiler: QueryProfiler, engine: Engine):
+        profile = RequestProfile("GET", "/questions")
+        for _ in range(2):
+            profile.add_transaction(engine)
+        for question_id in range(4):
+            profile.add_statement(f"SELECT * FROM a WHERE id = {question_id}", 0.001)
+        profile.add_statement("SELECT * FROM b", 0.2, slow={"statement": "SELECT * FROM b", "duration_ms": 200.0})
+        profiler.flag(profile)
+        assert profile.flags == ["statements>3", "transactions>1", "repeated-statement", "slow-statement"], \
+            "Flags missing or changed"
+        assert profile.to_dict()["repeated"] == {"SELECT * FROM a WHERE id = ?": 4}, "Repeated shape not reported"
+
+
+class TestProfilerThreads:
+    def test_concurrent_statements_all_counted(self):
+        profile = RequestProfile("GET", "/questions")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for _ in range(8):
+                pool.submit(lambda: [profile.add_statement("SELECT 1", 0.001) for _ in range(2_000)])
+        assert profile.statements == profile.shapes["SELECT ?"] == 16_000, "Concurrent statements lost"
+
+    def test_fan_out_statements_counted(self, tmp_path: Path):
+        uris = [f"sqlite:///{tmp_path / f'shard_{i}.db'}" for i in range(3)]
+        for uri in uris:
+            engine = create_engine(uri)
+            models.Base.metadata.create_all(engine)
+            engine.dispose()
+        client = QueriesApp(db_uri=uris[0], shard_uris=uris)
+        profiler = QueryProfiler()
+        profiler.instrument(client)
+
+        profile = RequestProfile("GET", "/questions")
+        token = _current_profile.set(profile)
+        try:
+            assert client.get_all_questions() == [], "Empty shards returned questions"
+        finally:
+            _current_profile.reset(token)
+            client.close()
+        assert profile.sessions == profile.transactions == 3, "Shard sessions not counted"
+        assert profile.statements >= 3, "Shard statements not counted"
+
+
+class TestProfilerAccess:
+    @staticmethod
+    def request(host: str, authorization: str | None = None) -> Request:
+        headers = [(b"authorization", authorization.encode())] if authorization else []
+        return Request({"type": "http", "method": "GET", "path": "/internal/profiler", "headers": headers,
+                        "client": (host, 50_000)})
+
+    @pytest.mark.parametrize("host", ["127.0.0.1", "::1"])
+    def test_loopback_allowed(self, host: str):
+        QueryProfiler().authorize(self.request(host))
+
+    @pytest.mark.parametrize("host", ["10.0.0.7", "testclient"])
+    def test_remote_denied(self, host: str):
+        with pytest.raises(HTTPException) as exc_info:
+            QueryProfiler().authorize(self.request(host))
+        assert exc_info.value.status_code == 403, "Remote client got the profiles"
+
+    def test_token(self):
+        profiler = QueryProfiler(token="s3cret")
+        profiler.authorize(self.request("10.0.0.7", "Bearer s3cret"))
+        for host, authorization in (("10.0.0.7", "Bearer wrong"), ("127.0.0.1", None)):
+            with pytest.raises(HTTPException):
+                profiler.authorize(self.request(host, authorization))
@@ -0,0 +1,231 @@
+# standard library modules
+import asyncio
+import time
+from collections import deque
+from types import SimpleNamespace
+
+# 3rd party modules
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+
+# local modules
+from core.db.resilience import (BREAKER_IGNORE, CircuitBreaker, CircuitOpen, DeadlineExceeded,
+                                TransientDatabaseError, guarded, remaining, reset_deadline, set_deadline)
+from core.main.deadlines import DeadlineMiddleware, StaleResponseMiddleware, database_unavailable_handler
+
+
+def call_asgi(app, path: str = "/", method: str = "GET", headers: list | None = None) -> list[dict]:
+    """Run one HTTP request through a pure ASGI app, return the messages sent"""
+    sent = []
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"", "headers": headers or []}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+class FakeClient:
+    def __init__(self, breaker: CircuitBreaker | None = None):
+        self.breaker = breaker
+        self.calls = 0
+
+    @guarded
+    def query(self, result=True):
+        self.calls += 1
+        return result
+
+    @guarded
+    def nested(self):
+        return self.query()
+
+
+class TestCircuitBreaker:
+    @pytest.fixture
+    def breaker(self) -> CircuitBreaker:
+        return CircuitBreaker(window=10, min_calls=4, failure_rate=0.5, slow_ms=50, open_seconds=0.05)
+
+    def test_trips_on_failure_rate(self, breaker: CircuitBreaker):
+        for failed in (False, True, False):
+            breaker.record(failed)
+        assert not breaker.is_open, "Tripped before `min_calls`"
+        breaker.record(True)
+        assert breaker.is_open, "Not tripped at the failure rate"
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+
+    def test_slow_counts_as_failed(self, breaker: CircuitBreaker):
+        for _ in range(4):
+            breaker.record(False, elapsed=0.1)
+        assert breaker.is_open, "Slow statements not counted as failed"
+
+    def test_half_open_probe_closes(self, breaker: CircuitBreaker):
+        breaker._trip()
+        time.sleep(0.06)
+        breaker.check()
+        assert breaker.state == CircuitBreaker.HALF_OPEN, "No half-open probe after `open_seconds`"
+        with pytest.raises(CircuitOpen):
+            breaker.check()
+        breaker.record(False)
+        assert breaker.state == CircuitBreaker.CLOSED, "Successful probe did not close the breaker"
+
+    def test_half_open_probe_reopens(self, breaker: CircuitBreaker):
+        breaker._trip()
+        time.sleep(0.06)
+        breaker.check()
+        breaker.record(True)
+        assert breaker.is_open, "Failed probe did not reopen the breaker"
+
+    def test_ignored_statements_not_recorded(self, breaker: CircuitBreaker):
+        engine = create_engine("sqlite://")
+        event.listen(engine, "before_cursor_execute", breaker.before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", breaker.after_cursor_execute)
+        with engine.connect() as conn:
+            conn.exec_driver_sql("SELECT 1", execution_options={BREAKER_IGNORE: True})
+            assert not breaker._outcomes, "Ignored statement recorded"
+            conn.exec_driver_sql("SELECT 1")
+            assert len(breaker._outcomes) == 1, "Statement not recorded"
+        engine.dispose()
+
+    @staticmethod
+    def error_context(sqlstate: str | None = None, is_disconnect: bool = False) -> SimpleNamespace:
+        original = Exception("canceling statement due to statement timeout")
+        original.sqlstate = sqlstate
+        return SimpleNamespace(is_disconnect=is_disconnect, original_exception=original,
+                               sqlalchemy_exception=OperationalError("SELECT 1", None, original))
+
+    def test_deadline_cancels_not_recorded(self, breaker: CircuitBreaker):
+        token = set_deadline(-0.01)
+        try:
+            for sqlstate in ("57014", "55P03"):
+                breaker.handle_error(self.error_context(sqlstate))
+            assert not breaker._outcomes, "Cancel by the request deadline recorded as a DB failure"
+            breaker.handle_error(self.error_context("57P01", is_disconnect=True))
+            assert breaker._outcomes == deque([True]), "Disconnect not recorded"
+        finally:
+            reset_deadline(token)
+
+    def test_server_timeouts_recorded(self, breaker: CircuitBreaker):
+        # no deadline, or a deadline far off: the server's own timeout fired
+        breaker.handle_error(self.error_context("57014"))
+        token = set_deadline(60)
+        try:
+            breaker.handle_error(self.error_context("57014"))
+            breaker.handle_error(self.error_context("53300"))
+        finally:
+            reset_deadline(token)
+        assert breaker._outcomes == deque([True] * 3), "Server-side error not recorded"
+
+
+class TestGuarded:
+    def test_expired_deadline(self):
+        client = FakeClient()
+        token = set_deadline(-1)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                client.query()
+        finally:
+            reset_deadline(token)
+        assert client.calls == 0, "Call ran past its deadline"
+
+    def test_miss_after_deadline_is_timeout(self):
+        client = FakeClient()
+
+        @guarded
+        def slow_miss(self):
+            time.sleep(0.02)
+            return None
+
+        token = set_deadline(0.01)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                slow_miss(client)
+        finally:
+            reset_deadline(token)
+
+    def test_open_breaker_fails_fast(self):
+        breaker = CircuitBreaker(open_seconds=60)
+        breaker._trip()
+        client = FakeClient(breaker)
+        with pytest.raises(CircuitOpen):
+            client.query()
+        assert client.calls == 0, "Call ran with the breaker open"
+
+    def test_nested_call_shares_the_probe(self):
+        breaker = CircuitBreaker(open_seconds=0.01)
+        breaker._trip()
+        time.sleep(0.02)
+        client = FakeClient(breaker)
+        assert client.nested() and client.calls == 1, "Nested call took a second probe"
+
+
+class TestDeadlineMiddleware:
+    @staticmethod
+    def deadline_seen(headers: list) -> float:
+        seen = {}
+
+        async def app(scope, receive, send):
+            seen["remaining"] = remaining()
+
+        call_asgi(DeadlineMiddleware(app, default_ms=1_000), headers=headers)
+        return seen["remaining"]
+
+    def test_default(self):
+        assert 0.9 < self.deadline_seen([]) <= 1.0, "Default deadline not applied"
+
+    def test_header_shortens(self):
+        assert self.deadline_seen([(b"x-request-timeout-ms", b"200")]) <= 0.2, "Header not applied"
+
+    def test_header_cannot_extend(self):
+        assert self.deadline_seen([(b"x-request-timeout-ms", b"60000")]) <= 1.0, "Header extended the deadline"
+
+    def test_invalid_header_ignored(self):
+        assert 0.9 < self.deadline_seen([(b"x-request-timeout-ms", b"soon")]) <= 1.0, "Invalid header used"
+
+
+class TestDatabaseUnavailableHandler:
+    @pytest.mark.parametrize("exc, status_code", [
+        (DeadlineExceeded("Request deadline exceeded"), 504),
+        (TransientDatabaseError("Commit failed: server closed the connection"), 503),
+        (CircuitOpen(5), 503),
+    ])
+    def test_status(self, exc: Exception, status_code: int):
+        response = asyncio.run(database_unavailable_handler(None, exc))
+        assert response.status_code == status_code, "Wrong status for an unavailable DB"
+
+
+class TestStaleResponseMiddleware:
+    @pytest.fixture
+    def db(self) -> dict:
+        return {"open": False}
+
+    @pytest.fixture
+    def middleware(self, db: dict) -> StaleResponseMiddleware:
+        async def app(scope, receive, send):
+            if db["open"]:
+                await send({"type": "http.response.start", "status": 503,
+                            "headers": [(b"content-type", b"application/json"), (b"x-circuit-open", b"1")]})
+                await send({"type": "http.response.body", "body": b'{"detail": "open"}'})
+                return
+            await send({"type": "http.response.start", "status": 200,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": b'{"ok": true}'})
+
+        return StaleResponseMiddleware(app, max_entries=10, max_bytes=1_000)
+
+    def test_replays_last_good_response(self, db: dict, middleware: StaleResponseMiddleware):
+        call_asgi(middleware, "/questions")
+        db["open"] = True
+        start, body = call_asgi(middleware, "/questions")
+        assert start["status"] == 200 and body["body"] == b'{"ok": true}', "Last good response not replayed"
+        assert (b"x-stale", b"1") in start["headers"], "Replay not marked stale"
+
+    def test_passes_503_without_stored_response(self, db: dict, middleware: StaleResponseMiddleware):
+        db["open"] = True
+        start, _ = call_asgi(middleware, "/questions")
+        assert start["status"] == 503, "503 WRONGFULLY replaced"
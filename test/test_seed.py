@@ -0,0 +1,60 @@
+# standard library modules
+from pathlib import Path
+
+# 3rd party modules
+import pytest
+from sqlalchemy import create_engine, select
+
+# local modules
+from core.db.models import Answer, Question, User
+from core.tools.seed import seed
+
+
+def dump(db_uri: str) -> dict[str, list[tuple]]:
+    engine = create_engine(db_uri)
+    with engine.connect() as conn:
+        rows = {
+            table.name: [tuple(row) for row in conn.execute(select(table).order_by(table.c.id))]
+            for table in (User.__table__, Question.__table__, Answer.__table__)
+        }
+    engine.dispose()
+    return rows
+
+
+class TestSeed:
+    sizes = {"users": 20, "questions": 50, "answers": 300}
+
+    @pytest.fixture
+    def db_uri(self, tmp_path: Path) -> str:
+        return f"sqlite:///{tmp_path / 'seed.db'}"
+
+    def test_deterministic(self, db_uri: str, tmp_path: Path):
+        other_uri = f"sqlite:///{tmp_path / 'other.db'}"
+        for uri in (db_uri, other_uri):
+            seed(uri, **self.sizes, seed_value=42, create_tables=True, batch_size=64)
+
+        rows = dump(db_uri)
+        assert rows == dump(other_uri), "Same seed, different data"
+        assert [len(rows[name]) for name in ("User", "Question", "Answer")] == [20, 50, 300], "Rows missing"
+
+        reseeded_uri = f"sqlite:///{tmp_path / 'reseeded.db'}"
+        seed(reseeded_uri, **self.sizes, seed_value=7, create_tables=True)
+        assert dump(reseeded_uri) != rows, "Seed ignored"
+
+    def test_run_twice_appends(self, db_uri: str):
+        first = seed(db_uri, **self.sizes, seed_value=42, create_tables=True)
+        second = seed(db_uri, **self.sizes, seed_value=42)
+        assert first["User"] == 20 and second["User"] == 0, "Existing users inserted again"
+
+        rows = dump(db_uri)
+        assert [row[0] for row in rows["Question"]] == list(range(1, 101)), "Question ids not appended"
+        assert [row[0] for row in rows["Answer"]] == list(range(1, 601)), "Answer ids not appended"
+        assert all(question_id > 50 for _, question_id, *_ in rows["Answer"][300:]), \
+            "Appended answers point at the earlier questions"
+
+    def test_explicit_offsets(self, db_uri: str):
+        seed(db_uri, **self.sizes, create_tables=True, question_id_offset=1_000, answer_id_offset=5_000)
+        rows = dump(db_uri)
+        assert rows["Question"][0][0] == 1_001 and rows["Answer"][0][0] == 5_001, "Offsets ignored"
+        assert {row[1] for row in rows["Answer"]} <= {row[0] for row in rows["Question"]}, \
+            "Answers point at missing questions"
@@ -0,0 +1,115 @@
+# standard library modules
+from pathlib import Path
+
+# 3rd party modules
+import pytest
+from sqlalchemy import create_engine, func, select
+
+# local modules
+from core.db import models
+from core.db.queries import QueriesApp
+from core.db.sharding import HashRing
+from core.tools.rebalance import rebalance
+
+
+class TestSharding:
+    n_questions = 60
+
+    @pytest.fixture(scope="class")
+    @classmethod
+    def shard_uris(cls, tmp_path_factory) -> list[str]:
+        root: Path = tmp_path_factory.mktemp("shards")
+        uris = [f"sqlite:///{root / f'shard_{i}.db'}" for i in range(3)]
+        for uri in uris:
+            engine = create_engine(uri)
+            models.Base.metadata.create_all(engine)
+            engine.dispose()
+        return uris
+
+    @pytest.fixture(scope="class")
+    @classmethod
+    def db_client(cls, shard_uris: list[str]) -> QueriesApp:
+        # two shards to start with, the third one is added by `rebalance`
+        client = QueriesApp(db_uri=shard_uris[0], shard_uris=shard_uris[:2])
+        yield client
+        client.close()
+
+    @staticmethod
+    def count_questions(uri: str) -> int:
+        engine = create_engine(uri)
+        with engine.connect() as conn:
+            n = conn.execute(select(func.count()).select_from(models.Question)).scalar_one()
+        engine.dispose()
+        return n
+
+    def test_ring_moves_keys_only_to_new_shard(self):
+        old, new = HashRing(2), HashRing(3)
+        for key in range(1, 2_000):
+            assert new.shard_for(key) in (old.shard_for(key), 2), "Key moved between old shards"
+
+    def test_create_user(self, db_client: QueriesApp):
+        assert db_client.create_user(models.User(id="root")), "Root user not created"
+
+    def test_create_questions_and_answers(self, db_client: QueriesApp):
+        for i in range(1, self.n_questions + 1):
+            assert db_client.create_question(models.Question(id=i, text=f"Question {i}?")), "Question not created"
+            assert db_client.create_answer(
+                models.Answer(id=i, question_id=i, user_id="root", text=f"Answer {i}")
+            ), "Answer not created"
+
+    def test_questions_spread_over_shards(self, shard_uris: list[str]):
+        counts = [self.count_questions(uri) for uri in shard_uris[:2]]
+        assert sum(counts) == self.n_questions and all(counts), "Questions not spread over shards"
+
+    def test_get_all_questions_merged(self, db_client: QueriesApp):
+        ids = [q.id for q in db_client.get_all_questions()]
+        assert ids == list(range(1, self.n_questions + 1)), "Fan-out not merged in id order"
+
+    def test_get_answer_by_id(self, db_client: QueriesApp):
+        assert db_client.get_answer(7).question_id == 7, "Answer not found across shards"
+
+    def test_answer_ids_unique_across_shards(self, db_client: QueriesApp):
+        other = next(i for i in range(2, self.n_questions + 1)
+                     if db_client.ring.shard_for(i) != db_client.ring.shard_for(1))
+        assert not db_client.create_answer(
+            models.Answer(id=1, question_id=other, user_id="root", text="Same id, other shard")
+        ), "Answer id WRONGFULLY reused on another shard"
+        assert db_client.get_answer(1).question_id == 1 and len(db_client.get_answers(other)) == 1, \
+            "Duplicate answer written"
+
+    def test_rebalance_onto_new_shard(self, db_client: QueriesApp, shard_uris: list[str]):
+        db_client.close()
+        stats = rebalance(shard_uris[0], shard_uris)
+        assert stats["questions"] == self.count_questions(shard_uris[2]) > 0, "No questions moved"
+
+        client = QueriesApp(db_uri=shard_uris[0], shard_uris=shard_uris)
+        assert all(client.get_question(i) for i in range(1, self.n_questions + 1)), "Question lost"
+        assert all(client.get_answers(i) for i in range(1, self.n_questions + 1)), "Answer lost"
+        client.close()
+
+    def test_delete_user_answers_in_batches(self, shard_uris: list[str]):
+        client = QueriesApp(db_uri=shard_uris[0], shard_uris=shard_uris)
+        assert client.count_answers(user_id="root") == self.n_questions, "Answers not counted across shards"
+
+        deleted = []
+        while batch := client.delete_answers_batch(10, user_id="root"):
+            assert batch <= 10 * len(shard_uris), "Batch not bounded"
+            deleted.append(batch)
+        assert sum(deleted) == self.n_questions and len(deleted) > 1, "Answers not deleted in batches"
+        assert client.delete_user("root") and not client.get_user("root"), "User not deleted"
+        client.close()
+
+    def test_create_user_all_or_nothing(self, tmp_path: Path):
+        uris = [f"sqlite:///{tmp_path / f'db_{i}.db'}" for i in range(2)]
+        # the replica has no `User` table, so writing the user there fails
+        engine = create_engine(uris[0])
+        models.Base.metadata.create_all(engine)
+        engine.dispose()
+
+        client = QueriesApp(db_uri=uris[0], shard_uris=uris)
+        assert not client.create_user(models.User(id="half")), "User created without its replica"
+        assert client.get_user("half") is None, "Global user kept after a failed replica write"
+
+        models.Base.metadata.create_all(client.engines[1])
+        assert client.create_user(models.User(id="half")), "Retry after a failed replica write failed"
+        client.close()
@@ -0,0 +1,47 @@
+# 3rd party modules
+import pytest
+
+# local modules
+from core.main.similarity import QuestionIndex
+
+
+class TestQuestionIndex:
+    questions = {
+        1: "How do I set a statement timeout in Postgres?",
+        2: "How do I set a statement timeout in Postgres",
+        3: "Why is my FastAPI endpoint slow?",
+        4: "How to configure a lock timeout in Postgres?",
+    }
+
+    @pytest.fixture
+    def index(self) -> QuestionIndex:
+        index = QuestionIndex(capacity=2)
+        index.load(self.questions.items())
+        return index
+
+    def test_load(self, index: QuestionIndex):
+        assert index.ready and index.size == len(self.questions), "Index not loaded"
+
+    def test_related_excludes_itself(self, index: QuestionIndex):
+        related = index.related(1, k=3)
+        assert related and related[0]["id"] == 2, "Near-duplicate not ranked first"
+        assert all(r["id"] != 1 for r in related), "Question related to itself"
+
+    def test_related_unknown_question(self, index: QuestionIndex):
+        assert index.related(50) is None, "Unknown question WRONGFULLY found"
+
+    def test_duplicate_text(self, index: QuestionIndex):
+        duplicates = index.similar_to("why is my fastapi endpoint slow", k=1, min_score=0.8)
+        assert [d["id"] for d in duplicates] == [3], "Duplicate not found"
+
+    def test_remove(self, index: QuestionIndex):
+        index.remove(2)
+        assert index.size == 3 and index.related(2) is None, "Question not removed"
+        assert all(r["id"] != 2 for r in index.related(1, k=3)), "Removed question still related"
+        assert index.related(4) is not None, "Moved row lost"
+
+    def test_texts_without_words(self, index: QuestionIndex):
+        index.add(5, "??")
+        assert index.similar_to("!?", min_score=0.8) == [], "Texts without words matched each other"
+        assert index.related(5) == [], "Text without words related to something"
+        assert all(r["id"] != 5 for r in index.related(1, k=10)), "Text without words is a candidate"
@@ -0,0 +1,80 @@
+# standard library modules
+import datetime
+from pathlib import Path
+
+# 3rd party modules
+import pytest
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+# local modules
+from core.db import models
+from core.db.snapshot import Snapshot, SnapshotCache, write_snapshot
+
+
+class TestSnapshot:
+    created_at = datetime.datetime(2024, 5, 1, 12, 30)
+
+    @pytest.fixture(scope="class")
+    @classmethod
+    def path(cls, tmp_path_factory) -> str:
+        path: Path = tmp_path_factory.mktemp("snapshot") / "hot.qas"
+        questions = [models.Question(id=i, text=f"Question {i}?", created_at=cls.created_at) for i in (9, 3, 5)]
+        answers = {
+            3: [models.Answer(id=31, question_id=3, user_id="root", text="Ответ", created_at=None)],
+            9: [models.Answer(id=i, question_id=9, user_id=f"user {i}", text=f"Answer {i}",
+                              created_at=cls.created_at) for i in (92, 91)],
+        }
+        write_snapshot(str(path), questions, answers)
+        return str(path)
+
+    @pytest.fixture
+    def snapshot(self, path: str) -> Snapshot:
+        snapshot = Snapshot(path)
+        yield snapshot
+        snapshot.close()
+
+    def test_questions_sorted(self, snapshot: Snapshot):
+        assert snapshot.q_ids.tolist() == [3, 5, 9], "Questions not sorted by id"
+        assert snapshot.find(4) is None, "Unknown question WRONGFULLY found"
+
+    def test_round_trip(self, snapshot: Snapshot):
+        question = snapshot.question(snapshot.find(9))
+        assert (question.text, question.created_at) == ("Question 9?", self.created_at), "Question changed"
+        answers = snapshot.answers(snapshot.find(9))
+        assert [(a.id, a.user_id) for a in answers] == [(91, "user 91"), (92, "user 92")], "Answers changed"
+        answer = snapshot.answers(snapshot.find(3))[0]
+        assert (answer.text, answer.created_at) == ("Ответ", None), "UTF-8 text or NULL date changed"
+        assert snapshot.answers(snapshot.find(5)) == [], "Question without answers got some"
+
+    def test_invalidation(self, snapshot: Snapshot):
+        cache = SnapshotCache(snapshot, ttl=60)
+        assert cache.get_question(3) is not None, "Snapshot question not served right away"
+        cache.invalidate_user("root")
+        assert cache.get_question(3) is None and cache.get_answers(9) is not None, "Wrong questions invalidated"
+
+    def test_reconcile(self, path: str, tmp_path: Path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'db.db'}")
+        models.Base.metadata.create_all(engine)
+        maker = sessionmaker(bind=engine, expire_on_commit=False)
+        snapshot = Snapshot(path)
+        assert snapshot.max_answer_id == 92, "Largest answer id not recorded"
+        with maker.begin() as session:
+            for row in range(snapshot.size):
+                session.add(snapshot.question(row))
+                session.add_all(snapshot.answers(row))
+
+        cache = SnapshotCache(snapshot, ttl=60)
+        assert cache.reconcile([maker]) == 0, "Unchanged snapshot marked stale"
+
+        # written through another worker: a new answer, a deleted question
+        with maker.begin() as session:
+            session.add(models.Answer(id=93, question_id=9, user_id="user 93", text="Later"))
+            session.add(models.Answer(id=94, question_id=404, user_id="user 94", text="Elsewhere"))
+            session.execute(delete(models.Question).where(models.Question.id == 5))
+        assert cache.reconcile([maker]) == 2, "Changed questions not marked"
+        assert cache.get_answers(9) is None and cache.get_question(5) is None, "Changed question still served"
+        assert cache.get_answers(3) is not None, "Unchanged question marked stale"
+
+        cache.close()
+        engine.dispose()
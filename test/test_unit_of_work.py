@@ -0,0 +1,80 @@
+# standard library modules
+import time
+from collections import Counter
+
+# 3rd party modules
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+# local modules
+from core.db import models
+from core.db.queries import UnitOfWork
+from core.main import endpoints
+from core.main.app import APP
+
+
+class TestUnitOfWork:
+    @pytest.fixture(scope="class")
+    @classmethod
+    def client(cls, tmp_path_factory) -> TestClient:
+        db_uri = f"sqlite:///{tmp_path_factory.mktemp('uow') / 'uow.db'}"
+        engine = create_engine(db_uri)
+        models.Base.metadata.create_all(engine)
+        engine.dispose()
+
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setenv("DB_URI", db_uri)
+            with TestClient(APP) as client:
+                # the related-questions index loads in the background
+                while endpoints.question_index and not endpoints.question_index.ready:
+                    time.sleep(0.01)
+                yield client
+
+    @pytest.fixture
+    def events(self, client: TestClient) -> Counter:
+        counts = Counter()
+        engine = endpoints.db_client.engine
+        listeners = {
+            "checkout": lambda *args: counts.update(["checkout"]),
+            "commit": lambda conn: counts.update(["commit"]),
+            "rollback": lambda conn: counts.update(["rollback"]),
+        }
+        for name, listener in listeners.items():
+            event.listen(engine, name, listener)
+        yield counts
+        for name, listener in listeners.items():
+            event.remove(engine, name, listener)
+
+    def test_one_checkout_one_commit(self, client: TestClient, events: Counter):
+        assert client.post("/new_user", json={"id": "root"}).status_code == 201, "User not created"
+        assert client.post("/questions", json={"id": 1, "text": "First question?"}).status_code == 201, \
+            "Question not created"
+        assert client.post("/questions/1/answers", json={"id": 1, "user_id": "root", "text": "Yes"}
+                           ).status_code == 201, "Answer not created"
+        assert events["checkout"] == events["commit"] == 3, "Not one checkout and one COMMIT per request"
+
+    def test_failed_call_rolls_back(self, client: TestClient, events: Counter):
+        response = client.post("/questions?allow_duplicate=true", json={"id": 1, "text": "Same id again?"})
+        assert response.status_code == 500, "Duplicate id WRONGFULLY accepted"
+        assert events["commit"] == 0 and events["rollback"] >= 1, "Failed request committed"
+
+    def test_failed_call_discards_earlier_writes(self, client: TestClient, events: Counter):
+        db_client, uow = endpoints.db_client, UnitOfWork()
+        assert db_client.create_question(models.Question(id=3, text="Kept?"), uow=uow), "Question not flushed"
+        assert not db_client.delete_answer(404, uow=uow), "Unknown answer WRONGFULLY deleted"
+        assert not db_client.commit(uow) and events["commit"] == 0, "Failed unit of work committed"
+        uow.close()
+        assert db_client.get_question(3) is None, "Write of a failed unit of work kept"
+
+    def test_commit_failure_is_db_unavailable(self, client: TestClient, events: Counter, monkeypatch):
+        def lost_connection(session):
+            raise OperationalError("COMMIT", None, Exception("server closed the connection"))
+
+        monkeypatch.setattr(Session, "commit", lost_connection)
+        response = client.post("/questions", json={"id": 2, "text": "Second question?"})
+        assert response.status_code == 503, "Failed COMMIT not reported as DB unavailable"
+        monkeypatch.undo()
+        assert client.get("/questions/2").json() == [None, None], "Question kept after failed COMMIT"